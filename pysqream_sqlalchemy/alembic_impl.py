@@ -0,0 +1,14 @@
+"""
+    Alembic support. Alembic finds the impl of a dialect by name among the
+    DefaultImpl subclasses defined so far, so the dialect imports this module
+    right after alembic.ddl is imported, instead of importing Alembic for
+    every engine.
+"""
+
+from alembic.ddl.impl import DefaultImpl
+
+
+class SQreamImpl(DefaultImpl):
+    """ Allows Alembic tool to recognize the dialect if installed """
+
+    __dialect__ = 'sqream'
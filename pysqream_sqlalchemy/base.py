@@ -1,8 +1,17 @@
-from sqlalchemy.sql import compiler, crud, elements
-from sqlalchemy import exc
-from sqlalchemy.dialects.mysql import TINYINT
+from decimal import Decimal
+from functools import partial
+from time import perf_counter
+
+from sqlalchemy.engine.default import DefaultExecutionContext
+from sqlalchemy.sql import compiler, crud, elements, visitors
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy import exc, literal, util
+from sqlalchemy.engine import processors
+from sqlalchemy.types import ARRAY, BigInteger, Boolean, Date, DateTime, Float, Integer, Numeric, SmallInteger
 from sqlalchemy.sql.compiler import FUNCTIONS, OPERATORS
 
+from pysqream_sqlalchemy.saved_queries import SAVED_QUERY_OPTION
+
 
 NOT_SUPPORTED_OPERATORS = ['NULLS FIRST', 'NULLS LAST']
 NOT_SUPPORTED_FUNCTIONS = ['aggregate_strings', 'cube', 'current_time', 'current_user', 'grouping_sets', 'localtime',
@@ -11,13 +20,226 @@ NOT_SUPPORTED_PARAMETERIZED_FUNCTIONS = ['char_length', 'coalesce', 'concat', 'p
                                          'nth_value', 'ntile']
 
 
-class TINYINT(TINYINT):
+DEFAULT_SCHEMA = 'public'
+SESSION_KEY = 'sqream_session'
+
+
+def qualified_table_name(name, schema=None):
+    """ schema.table form used to track which tables statements read and write """
+    return f"{schema or DEFAULT_SCHEMA}.{name}"
+
+
+def is_parameterized(element):
+    """
+        True for bound parameters that would be sent to SQream as ? placeholders.
+        literal_execute parameters are rendered inline and are fine
+    """
+    return hasattr(element, "value") and not getattr(element, "literal_execute", False)
+
+
+def _literal_execute_bind(element):
+    """ replacement_traverse hook, turning bound parameters into literal_execute ones """
+    if isinstance(element, elements.BindParameter) and not element.literal_execute:
+        return element.render_literal_execute()
+    return None
+
+
+def _inline_bind(clause):
+    """ Clause rendered inline at execution when it is a plain bound value, e.g. LIMIT and OFFSET """
+    if isinstance(clause, elements.BindParameter):
+        return clause.render_literal_execute()
+    return clause
+
+
+def inline_literal(value, column):
+    """
+        value as a literal of column's type, rendered inline at execution. SQream binds
+        parameters only in INSERT ... VALUES, so generated predicates use these
+    """
+    return literal(value, type_=column.type, literal_execute=True)
+
+
+class TINYINT(Integer):
     """
         Allows describing tables via the ORM mechanism.
         Complemented in SqreamTypeCompiler
     """
 
-    pass
+    __visit_name__ = 'TINYINT'
+
+
+def _masked_column(values, dtype, fill):
+    """ NumPy array of a column whose type has no NULL value of its own, masked where values are None """
+    import numpy as np
+
+    mask = [value is None for value in values]
+    if not any(mask):
+        return np.array(values, dtype=dtype)
+    return np.ma.masked_array(np.array([fill if value is None else value for value in values], dtype=dtype), mask=mask)
+
+
+class SqreamDate(Date):
+    """
+        pysqream already returns datetime.date objects, so there is no per value
+        result processor. column_processor() converts a whole column to datetime64[D]
+    """
+
+    def result_processor(self, dialect, coltype):
+        return None
+
+    def column_processor(self, dialect):
+        import numpy as np
+
+        return partial(np.array, dtype='datetime64[D]')
+
+
+class SqreamDateTime(DateTime):
+    """ As SqreamDate, columns become datetime64[ms] which is SQream's DATETIME precision """
+
+    def result_processor(self, dialect, coltype):
+        return None
+
+    def column_processor(self, dialect):
+        import numpy as np
+
+        return partial(np.array, dtype='datetime64[ms]')
+
+
+NUMERIC_AS = ('decimal', 'float', 'scaled_int')
+
+
+def check_numeric_as(numeric_as):
+    if numeric_as is not None and numeric_as not in NUMERIC_AS:
+        raise exc.ArgumentError(f"numeric_as must be one of {', '.join(NUMERIC_AS)}, got {numeric_as}")
+    return numeric_as
+
+
+def _scaled_int(value, scale):
+    return None if value is None else int(Decimal(value).scaleb(scale).to_integral_value())
+
+
+class SqreamNumeric(Numeric):
+    """
+        NUMERIC values are returned according to numeric_as, set per column or for
+        the whole engine (create_engine(..., numeric_as=...) or ?numeric_as= in the URL):
+
+        decimal     Decimal, exact (Numeric(asdecimal=False) still gives floats)
+        float       float64, exact up to 15 significant digits
+        scaled_int  int64 holding value * 10 ** scale, exact for precision <= 18.
+                    Columns without a declared scale stay Decimal
+
+        Columns fetched with fetch_columns() become float64, int64 or Decimal object arrays
+    """
+
+    def __init__(self, precision=None, scale=None, decimal_return_scale=None, asdecimal=True, numeric_as=None):
+        super().__init__(precision, scale, decimal_return_scale, asdecimal)
+        self.numeric_as = check_numeric_as(numeric_as)
+
+    def _numeric_as(self, dialect):
+        numeric_as = self.numeric_as or getattr(dialect, 'numeric_as', None) or 'decimal'
+        if numeric_as == 'scaled_int' and self.scale is None:
+            return 'decimal'
+        if numeric_as == 'decimal' and not self.asdecimal:
+            return 'float'
+        return numeric_as
+
+    def result_processor(self, dialect, coltype):
+        numeric_as = self._numeric_as(dialect)
+        if numeric_as == 'float':
+            return processors.to_float
+        if numeric_as == 'scaled_int':
+            return partial(_scaled_int, scale=self.scale)
+        return None  # pysqream already returns Decimal
+
+    def column_processor(self, dialect):
+        import numpy as np
+
+        numeric_as = self._numeric_as(dialect)
+        if numeric_as == 'float':
+            return partial(np.array, dtype=np.float64)  # NULLs become NaN
+        if numeric_as == 'scaled_int':
+            return lambda values: _masked_column([_scaled_int(value, self.scale) for value in values], np.int64, 0)
+        return partial(np.array, dtype=object)
+
+
+class SqreamBoolean(Boolean):
+    """ Columns become bool arrays, masked where NULL """
+
+    def result_processor(self, dialect, coltype):
+        return None
+
+    def column_processor(self, dialect):
+        return partial(_masked_column, dtype=bool, fill=False)
+
+
+class SqreamArray(ARRAY):
+    """
+        SQream one dimensional arrays, SqreamArray(Integer) is INT[]. Bound values can
+        be lists, tuples or NumPy arrays, fetched values are lists (tuples with
+        as_tuple=True). fetch_columns() returns array columns as an ArrayColumn,
+        one flat NumPy buffer of all the items plus offsets. Only reading is columnar:
+        pysqream packs inserted arrays row by row from Python items, so bound values
+        are always converted to one list per row
+    """
+
+    def __init__(self, item_type, as_tuple=False, dimensions=None, zero_indexes=False):
+        if dimensions not in (None, 1):
+            raise exc.ArgumentError("SQream arrays have a single dimension")
+        super().__init__(item_type, as_tuple=as_tuple, dimensions=dimensions, zero_indexes=zero_indexes)
+
+    def bind_processor(self, dialect):
+        def process(value):
+            if value is None:
+                return None
+            tolist = getattr(value, 'tolist', None)
+            return tolist() if tolist is not None else list(value)
+
+        return process
+
+    def result_processor(self, dialect, coltype):
+        if self.as_tuple:
+            return lambda value: None if value is None else tuple(value)
+        return None
+
+    def column_processor(self, dialect):
+        from pysqream_sqlalchemy.columnar import ArrayColumn, _default_column
+
+        item_type = dialect.type_descriptor(self.item_type) if dialect is not None else self.item_type
+        item_processor = getattr(item_type, 'column_processor', None)
+        return partial(ArrayColumn.from_lists,
+                       item_processor=item_processor(dialect) if item_processor is not None else _default_column)
+
+
+FIXED_WIDTHS = {
+    Boolean: 1,
+    TINYINT: 1,
+    SmallInteger: 2,
+    BigInteger: 8,
+    Integer: 4,
+    Float: 8,
+    Numeric: 16,
+    DateTime: 8,
+    Date: 4,
+}
+UNBOUNDED_WIDTH = 256  # assumed for text columns declared without a length
+DEFAULT_BUFFER_BYTES = 64 * 1024 * 1024
+
+
+def type_width(type_):
+    """ Bytes a value of the type takes in a SQream fetch or insert buffer, including its NULL flag """
+    length = getattr(type_, 'length', None)
+    if length:
+        return length + 1
+    for cls in type(type_).__mro__:
+        if cls in FIXED_WIDTHS:
+            return FIXED_WIDTHS[cls] + 1
+    return UNBOUNDED_WIDTH
+
+
+def rows_per_buffer(types, max_rows, buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """ Rows of the given column types fitting in buffer_bytes, at most max_rows and at least one """
+    row_width = sum(type_width(type_) for type_ in types) or 1
+    return max(1, min(max_rows, buffer_bytes // row_width))
 
 
 class SqreamTypeCompiler(compiler.GenericTypeCompiler):
@@ -30,8 +252,50 @@ class SqreamTypeCompiler(compiler.GenericTypeCompiler):
     def visit_TINYINT(self, type_, **kw):
         return "TINYINT"
 
+    def visit_ARRAY(self, type_, **kw):
+        return f"{self.process(type_.item_type, **kw)}[]"
+
 
 class SqreamSQLCompiler(compiler.SQLCompiler):
+    compile_time = 0.0
+
+    def __init__(self, dialect, statement, cache_key=None, column_keys=None, for_executemany=False, **kwargs):
+        start = perf_counter()
+        durable = getattr(dialect, 'durable_compiled_cache', None)
+        entry = None
+        if durable is not None and cache_key is not None and not kwargs.get('schema_translate_map') and \
+                not kwargs.get('compile_kwargs'):
+            entry = durable.entry_name(dialect, cache_key, column_keys, for_executemany)
+        if entry is not None:
+            self.dialect = dialect
+            self.preparer = dialect.identifier_preparer
+            if durable.restore(self, entry, statement, cache_key):
+                self.compile_time = perf_counter() - start
+                return
+
+        super().__init__(dialect, statement, cache_key=cache_key, column_keys=column_keys,
+                         for_executemany=for_executemany, **kwargs)
+        self.compile_time = perf_counter() - start
+        if entry is not None:
+            durable.store(self, entry, statement, cache_key)
+
+    @util.memoized_property
+    def write_tables(self):
+        """ Tables written by a compiled INSERT, UPDATE or DELETE """
+        if not (self.isinsert or self.isupdate or self.isdelete):
+            return frozenset()
+        return frozenset(qualified_table_name(table.name, table.schema) for table in find_tables(self.statement.table))
+
+    @util.memoized_property
+    def saved_query(self):
+        """ Compiled for execution as a server-side saved query, which binds ? parameters """
+        return bool(getattr(self.statement, '_execution_options', {}).get(SAVED_QUERY_OPTION))
+
+    @util.memoized_property
+    def read_tables(self):
+        """ Tables referenced anywhere in the compiled statement """
+        return frozenset(qualified_table_name(table.name, table.schema) for table in find_tables(self.statement))
+
     def visit_select(
         self,
         select_stmt,
@@ -67,9 +331,12 @@ class SqreamSQLCompiler(compiler.SQLCompiler):
 
         select_stmt = compile_state.statement
 
-        if select_stmt.whereclause is not None and \
+        if kwargs.get("literal_binds") or self.saved_query:
+            pass  # parameters are rendered inline, as in CREATE TABLE AS, or bound by execute_saved_query
+
+        elif select_stmt.whereclause is not None and \
                 (hasattr(select_stmt.whereclause, "left") and hasattr(select_stmt.whereclause, "right")) and (
-                (hasattr(select_stmt.whereclause.left, "value")) or (hasattr(select_stmt.whereclause.right, "value"))):
+                (is_parameterized(select_stmt.whereclause.left)) or (is_parameterized(select_stmt.whereclause.right))):
             raise NotSupportedException("Where clause of parameterized query not supported on SQream")
 
         elif select_stmt.whereclause is not None and hasattr(select_stmt.whereclause, "whens"):
@@ -288,6 +555,27 @@ class SqreamSQLCompiler(compiler.SQLCompiler):
                 "Unary expression has no operator or modifier"
             )
 
+    def limit_clause(self, select, **kw):
+        """ SQream doesn't bind LIMIT and OFFSET either, integer values are rendered inline at execution """
+        text = ""
+        if select._limit_clause is not None:
+            text += "\n LIMIT " + self.process(_inline_bind(select._limit_clause), **kw)
+        if select._offset_clause is not None:
+            if select._limit_clause is None:
+                text += "\n LIMIT -1"
+            text += " OFFSET " + self.process(_inline_bind(select._offset_clause), **kw)
+        return text
+
+    def visit_insert(self, insert_stmt, visiting_cte=None, **kw):
+        """
+            SQream binds ? parameters only in INSERT ... VALUES, so the parameters
+            of an INSERT ... SELECT are rendered inline when it is executed
+        """
+        if insert_stmt.select is not None:
+            insert_stmt = insert_stmt._generate()
+            insert_stmt.select = visitors.replacement_traverse(insert_stmt.select, {}, _literal_execute_bind)
+        return super().visit_insert(insert_stmt, visiting_cte=visiting_cte, **kw)
+
     def visit_delete(self, delete_stmt, visiting_cte=None, **kw):
         compile_state = delete_stmt._compile_state_factory(
             delete_stmt, self, **kw
@@ -296,12 +584,12 @@ class SqreamSQLCompiler(compiler.SQLCompiler):
         if delete_stmt.whereclause is not None and hasattr(delete_stmt.whereclause, "clauses"):
             for cla in delete_stmt.whereclause.clauses:
                 if (hasattr(cla, "left") and hasattr(cla, "right")) and \
-                        (hasattr(cla.left, "value") or (hasattr(cla.right, "value"))):
+                        (is_parameterized(cla.left) or (is_parameterized(cla.right))):
                     raise NotSupportedException("Where clause of parameterized query not supported on SQream")
 
         elif delete_stmt.whereclause is not None and \
                 (hasattr(delete_stmt.whereclause, "left") and hasattr(delete_stmt.whereclause, "right")) and (
-                (hasattr(delete_stmt.whereclause.left, "value")) or (hasattr(delete_stmt.whereclause.right, "value"))):
+                (is_parameterized(delete_stmt.whereclause.left)) or (is_parameterized(delete_stmt.whereclause.right))):
             raise NotSupportedException("Where clause of parameterized query not supported on SQream")
 
         if visiting_cte is not None:
@@ -326,7 +614,7 @@ class SqreamSQLCompiler(compiler.SQLCompiler):
             from_linter = None
             warn_linting = False
 
-        extra_froms = compile_state._extra_fromss
+        extra_froms = compile_state._extra_froms
 
         correlate_froms = {delete_stmt.table}.union(extra_froms)
         self.stack.append(
@@ -436,7 +724,7 @@ class SqreamSQLCompiler(compiler.SQLCompiler):
 
         if update_stmt.whereclause is not None and \
                 (hasattr(update_stmt.whereclause, "left") and hasattr(update_stmt.whereclause, "right")) and (
-                (hasattr(update_stmt.whereclause.left, "value")) or (hasattr(update_stmt.whereclause.right, "value"))):
+                (is_parameterized(update_stmt.whereclause.left)) or (is_parameterized(update_stmt.whereclause.right))):
             raise NotSupportedException("Where clause of parameterized query not supported on SQream")
 
         if toplevel:
@@ -614,6 +902,16 @@ class SqreamSQLCompiler(compiler.SQLCompiler):
             text += " WITH ORDINALITY"
         return text
 
+    def visit_approx_count_distinct_func(self, func, **kw):
+        """ No sketch based distinct count on SQream, exact unless evaluated over a sample """
+        return f"count(distinct {self.process(func.clauses, **kw)})"
+
+    def visit_approx_percentile_func(self, func, **kw):
+        """ approx_percentile(x, fraction) as the discrete percentile, the fraction is rendered inline """
+        expr, fraction = func.clauses.clauses
+        return (f"percentile_disc({self.process(_inline_bind(fraction), **kw)}) "
+                f"within group (order by {self.process(expr, **kw)})")
+
     def visit_concat_func(self, concat, **kw):
         concat_str = " || "
         question_mark = []
@@ -671,6 +969,54 @@ class SqreamSQLCompiler(compiler.SQLCompiler):
 
 
 class SqreamDDLCompiler(compiler.DDLCompiler):
+    def get_column_specification(self, column, **kwargs):
+        """ Column(..., sqream_compression="dict") adds a CHECK('CS "dict"') compression spec """
+        colspec = super().get_column_specification(column, **kwargs)
+        compression = column.dialect_options['sqream']['compression']
+        if compression:
+            colspec += f" CHECK('CS \"{compression}\"')"
+        return colspec
+
+    def post_create_table(self, table):
+        """ Table(..., sqream_cluster_by=["a", "b"]) adds CLUSTER BY keys for data skipping """
+        cluster_by = table.dialect_options['sqream']['cluster_by']
+        if not cluster_by:
+            return ""
+        if isinstance(cluster_by, str):
+            cluster_by = [cluster_by]
+        keys = [self.preparer.format_column(key) if hasattr(key, 'name') and hasattr(key, 'table')
+                else self.preparer.quote(key) for key in cluster_by]
+        return f" CLUSTER BY {', '.join(keys)}"
+
+    def visit_create_table_as(self, create, **kw):
+        select = self.sql_compiler.process(create.select, literal_binds=True)
+        return (f"CREATE {'OR REPLACE ' if create.or_replace else ''}TABLE "
+                f"{self.preparer.format_table(create.element)} AS {select}")
+
+    def visit_truncate(self, truncate, **kw):
+        text = f"TRUNCATE TABLE {self.preparer.format_table(truncate.element)}"
+        if truncate.restart_identity:
+            text += " RESTART IDENTITY"
+        return text
+
+    def visit_create_foreign_table(self, create, **kw):
+        table = create.element
+        columns = [self.process(column) for column in create.columns]
+        text = f"\nCREATE {'OR REPLACE ' if create.or_replace else ''}FOREIGN TABLE {self.preparer.format_table(table)} ("
+        text += "\n\t" + ", \n\t".join(column for column in columns if column is not None) + "\n)"
+        text += f"\nWRAPPER {create.wrapper}"
+        options = {'location': create.location, **create.options}
+        rendered = [f"{name.upper()} = {self.render_option_value(value)}" for name, value in options.items()]
+        text += "\nOPTIONS (\n\t" + ", \n\t".join(rendered) + "\n)\n\n"
+        return text
+
+    def render_option_value(self, value):
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, (int, float)):
+            return str(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
     def visit_identity_column(self, identity, **kw):
         self.check_identity_options(identity)
         text = " IDENTITY"
@@ -714,6 +1060,109 @@ class SqreamDDLCompiler(compiler.DDLCompiler):
             raise NotSupportedException("cycle of identity key constraints are not supported by SQream")
 
 
+def render_session_parameter(name, value):
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    elif isinstance(value, str):
+        value = "'" + value.replace("'", "''") + "'"
+    return f"SET {name} = {value}"
+
+
+class PooledSession:
+    """
+        SQream runs every cursor in a session of its own, so session parameters only
+        stick to the cursor they were set on. A pooled connection keeps one cursor
+        open for its statements and remembers the parameters already set on it
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.applied = {}
+        self.in_use = False
+        self.broken = False
+
+    def apply(self, parameters):
+        """ Set the parameters that changed since the last call, no round trip when none did """
+        for name, value in parameters.items():
+            if name not in self.applied or self.applied[name] != value:
+                self.cursor.execute(render_session_parameter(name, value))
+                self.applied[name] = value
+
+
+class SessionCursor:
+    """ Lends the cursor of a PooledSession to a single statement, close() gives it back """
+
+    def __init__(self, session, release):
+        self._session = session
+        self._release = release
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._session.cursor, name)
+
+    def _call(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            self._session.broken = True  # state of the session is unknown, it won't be reused
+            raise
+
+    def execute(self, *args, **kwargs):
+        return self._call(self._session.cursor.execute, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._call(self._session.cursor.executemany, *args, **kwargs)
+
+    def fetchone(self):
+        return self._call(self._session.cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._call(self._session.cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._call(self._session.cursor.fetchall)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._release(self._session)
+
+
+class ServiceCursor:
+    """ Cursor of a connection checked out of a service sub-pool, returns it to the pool on close """
+
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def close(self):
+        try:
+            self._cursor.close()
+        finally:
+            self._connection.close()
+
+
+class SqreamExecutionContext(DefaultExecutionContext):
+
+    def create_cursor(self):
+        """ Statements with a sqream_service execution option run on a connection to that service queue """
+        service = self.execution_options.get('sqream_service')
+        pool = self.dialect.service_pool(service) if service is not None else None
+        if pool is None:
+            if self.dialect.session_parameters is None:
+                return super().create_cursor()
+            return self.dialect.session_cursor(self.root_connection.connection)
+        connection = pool.connect()
+        try:
+            return ServiceCursor(self.dialect.session_cursor(connection), connection)
+        except Exception:
+            connection.close()
+            raise
+
+
 class NotSupportedException(Exception):
     pass
 
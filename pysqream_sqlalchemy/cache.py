@@ -0,0 +1,439 @@
+"""
+    Client side result caching for repeated SELECT statements.
+
+    Caching is opt-in per statement (or per engine/connection) through the
+    sqream_cache_ttl execution option:
+
+        conn.execute(stmt.execution_options(sqream_cache_ttl=30))
+
+    The dialect materializes the result of a cached statement once and serves
+    later executions of the same SQL and parameters from a replay cursor.
+
+    The same replay mechanism backs single-flight execution (single_flight=True
+    on create_engine), where identical SELECTs running concurrently share the
+    result of the first one. That result is fetched into one list per column,
+    and only when another caller is actually waiting for it.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping, Sequence
+
+from pysqream_sqlalchemy.base import qualified_table_name
+
+
+_IDENTIFIER = r'((?:"[^"]+"|[\w$]+)(?:\s*\.\s*(?:"[^"]+"|[\w$]+))?)'
+_WRITE_RE = re.compile(r'^\s*(?:insert\s+into|update|delete\s+from|truncate(?:\s+table)?|'
+                       r'(?:create(?:\s+or\s+replace)?|drop|alter)\s+(?:foreign\s+)?table(?:\s+if\s+(?:not\s+)?exists)?)\s+'
+                       + _IDENTIFIER, re.IGNORECASE)
+_READ_RE = re.compile(r'\b(?:from|join)\s+' + _IDENTIFIER, re.IGNORECASE)
+
+SHARE_BATCH_SIZE = 10_000
+
+# pseudo table whose generation changes with every DDL statement
+SCHEMA_GENERATION = '*schema*'
+
+
+class MaterializedCursor:
+    """ DB-API cursor look-alike that replays an already fetched result """
+
+    def __init__(self, description, rows):
+        self.description = description
+        self.rowcount = len(rows)
+        self.arraysize = 1
+        self._rows = rows
+        self._position = 0
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        row = self._rows[self._position]
+        self._position += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def close(self):
+        self._rows = []
+        self._position = 0
+
+
+class ColumnarRows(Sequence):
+    """ Rows of a result kept as one list per column, the row tuples are built when read """
+
+    def __init__(self, columns, count):
+        self.columns = columns
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(*(column[index] for column in self.columns)))
+        return tuple(column[index] for column in self.columns)
+
+
+class CachedResult:
+    """ A fetched result, shared read-only between everybody replaying it """
+
+    def __init__(self, description, rows, expires_at=None):
+        self.description = description
+        self.rows = rows
+        self.expires_at = expires_at
+
+    @property
+    def expired(self):
+        return self.expires_at is not None and self.expires_at <= time.time()
+
+    def cursor(self):
+        return MaterializedCursor(self.description, self.rows)
+
+    @classmethod
+    def from_cursor(cls, cursor, ttl=None):
+        rows = [tuple(row) for row in cursor.fetchall()]
+        description = [tuple(col) for col in cursor.description]
+        return cls(description, rows, None if ttl is None else time.time() + ttl)
+
+    @classmethod
+    def from_cursor_columns(cls, cursor, batch_size=SHARE_BATCH_SIZE):
+        """ Fetch the result in batches into per column lists, no row tuple outlives its batch """
+        description = [tuple(col) for col in cursor.description]
+        columns = [[] for _ in description]
+        count = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+            count += len(rows)
+        return cls(description, ColumnarRows(columns, count))
+
+
+def _frozen(value):
+    """ Parameters as nested tuples, mappings as their sorted items, so equal values give equal keys """
+    if isinstance(value, Mapping):
+        return tuple(sorted((key, _frozen(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(item) for item in value)
+    return value
+
+
+def make_cache_key(statement, parameters, *extra):
+    """ Stable key for a statement, its literal values and whatever else affects the result """
+
+    payload = repr((statement, _frozen(parameters or ()), extra))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _parse_table_name(identifier):
+    parts = [part.strip() for part in identifier.split('.')]
+    parts = [part[1:-1] if part.startswith('"') else part.lower() for part in parts]
+    return qualified_table_name(parts[-1], parts[0] if len(parts) == 2 else None)
+
+
+def written_tables(statement):
+    """ Table written by a plain SQL string, for statements that were not compiled by SQLAlchemy """
+
+    match = _WRITE_RE.match(statement)
+    return frozenset([_parse_table_name(match.group(1))]) if match else frozenset()
+
+
+def read_tables(statement):
+    """ Best effort list of the tables following FROM / JOIN in a plain SQL string """
+
+    return frozenset(_parse_table_name(identifier) for identifier in _READ_RE.findall(statement))
+
+
+class WriteTracker:
+    """
+        Keeps a write counter for every table an engine has changed, and calls
+        the registered listeners with the set of table names after each write.
+        Caches can either listen and drop dependent entries, or fold versions()
+        into their keys so that entries of changed tables are never hit again
+    """
+
+    def __init__(self):
+        self._versions = defaultdict(int)
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, fn):
+        """ fn(tables) is called with a frozenset of schema.table names after every write """
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        self._listeners.remove(fn)
+
+    def record(self, tables):
+        if not tables:
+            return
+        with self._lock:
+            for table in tables:
+                self._versions[table] += 1
+        for fn in list(self._listeners):
+            fn(tables)
+
+    def version(self, table):
+        return self._versions.get(table, 0)
+
+    def versions(self, tables):
+        """ Hashable snapshot of the write counters of the given tables """
+        return tuple((table, self._versions.get(table, 0)) for table in sorted(tables))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+        self.waiting = 0
+
+
+class SingleFlight:
+    """
+        Collapses concurrent calls with the same key into one: the first caller
+        runs the function, callers arriving while it runs wait for it and share
+        its return value instead of running their own
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, fn, share=None, timeout=None):
+        """
+            Returns (value, executed). executed is False for callers that received
+            the first caller's value; when the first caller raised, they get
+            (None, False) and decide for themselves whether to retry.
+            With share, the first caller's value is passed through share() before
+            it is handed out, and only when other callers are waiting for it: the
+            first caller then gets share()'s return value too.
+            Waiting callers raise TimeoutError after timeout seconds
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiting += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    call.waiting -= 1
+                raise TimeoutError(f"Gave up waiting for the first caller after {timeout} seconds")
+            return (None if call.failed else call.result), False
+
+        try:
+            value = fn()
+            if share is not None:
+                with self._lock:
+                    if not call.waiting:
+                        del self._calls[key]
+                        call = None
+                if call is None:
+                    return value, True
+                value = share(value)
+            call.result = value
+        except BaseException:
+            call.failed = True
+            raise
+        finally:
+            if call is not None:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        return call.result, True
+
+
+class MemoryResultCache:
+    """
+        Process local LRU of results. Bounded by number of entries and by the
+        total number of cached rows; results bigger than max_rows are not cached
+    """
+
+    shared = False
+
+    def __init__(self, max_entries=256, max_rows=1_000_000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expired:
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if len(entry.rows) > self.max_rows:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = entry
+            self._rows += len(entry.rows)
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key)
+        self._rows -= len(entry.rows)
+
+
+class DiskResultCache:
+    """
+        Results stored as Arrow IPC files in a directory, which can be shared by
+        several processes on the same host. Files are read back memory mapped.
+        Eviction is LRU by file modification time, touched on every hit.
+        The write counters of one process mean nothing to the others, so the
+        directory also keeps a generation token per written table, replaced on
+        every write by any process, which the dialect folds into the keys.
+        Requires pyarrow
+    """
+
+    suffix = ".arrow"
+    shared = True
+
+    def __init__(self, path, max_entries=1024, max_rows=10_000_000):
+        import pyarrow  # noqa: F401 - fail early when the optional dependency is missing
+
+        self.path = path
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def __len__(self):
+        return len([name for name in os.listdir(self.path) if name.endswith(self.suffix)])
+
+    def _generation_file(self, table):
+        return os.path.join(self.path, "generations", hashlib.sha1(table.encode()).hexdigest())
+
+    def versions(self, tables):
+        """ Hashable snapshot of the generation tokens of the given tables, as all processes see them """
+        versions = []
+        for table in sorted(tables):
+            try:
+                with open(self._generation_file(table), encoding="utf-8") as source:
+                    versions.append((table, source.read()))
+            except FileNotFoundError:
+                versions.append((table, None))
+        return tuple(versions)
+
+    def record(self, tables):
+        """ New generation tokens for written tables, results keyed under the old ones are not hit again """
+        os.makedirs(os.path.join(self.path, "generations"), exist_ok=True)
+        for table in tables:
+            path = self._generation_file(table)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as sink:
+                sink.write(uuid.uuid4().hex)
+            os.replace(tmp_path, path)
+
+    def get(self, key):
+        import pyarrow as pa
+
+        path = self._file(key)
+        try:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+
+        meta = json.loads(table.schema.metadata[b"sqream"])
+        if meta["expires_at"] is not None and meta["expires_at"] <= time.time():
+            self.delete(key)
+            return None
+        os.utime(path)
+        rows = list(zip(*(column.to_pylist() for column in table.columns)))
+        return CachedResult([tuple(col) for col in meta["description"]], rows, meta["expires_at"])
+
+    def set(self, key, entry):
+        import pyarrow as pa
+
+        if len(entry.rows) > self.max_rows:
+            return
+        names = [col[0] for col in entry.description]
+        columns = list(zip(*entry.rows)) if entry.rows else [[] for _ in names]
+        try:
+            arrays = [pa.array(column) for column in columns]
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return  # mixed value types, leave this one uncached
+        meta = {"description": entry.description, "expires_at": entry.expires_at}
+        schema = pa.schema([pa.field(name, array.type) for name, array in zip(names, arrays)],
+                           metadata={"sqream": json.dumps(meta, default=str)})
+        table = pa.Table.from_arrays(arrays, schema=schema)
+
+        tmp_path = f"{self._file(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, self._file(key))
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith(self.suffix):
+                self.delete(name[:-len(self.suffix)])
+
+    def _evict(self):
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith(self.suffix):
+                try:
+                    files.append((os.path.getmtime(os.path.join(self.path, name)), name))
+                except FileNotFoundError:
+                    pass
+        files.sort()
+        for _, name in files[:max(0, len(files) - self.max_entries)]:
+            self.delete(name[:-len(self.suffix)])
@@ -0,0 +1,166 @@
+"""
+    Statement timeouts and cooperative cancellation.
+
+    A statement executed with execution_options(timeout=seconds) is stopped on
+    the server (stop_statement) once its deadline passes, whether it is still
+    executing or its result is being fetched. The caller then gets a
+    StatementTimeoutException and the pooled connection stays usable, since the
+    statement ran on its own cursor.
+
+    cancel(connection) stops whatever statement another thread is running on
+    a Connection, and execute_cancellable() wires that to asyncio cancellation.
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+
+RUNNING_KEY = 'sqream_running_statement'
+RETRY_INTERVAL = 0.1
+
+
+class StatementCancelledException(Exception):
+    pass
+
+
+class StatementTimeoutException(StatementCancelledException):
+    pass
+
+
+class Ticket:
+    """ A running statement, as seen by the watchdog """
+
+    def __init__(self, cursor, timeout=None):
+        self.cursor = cursor
+        # a reused cursor reports the id of its previous statement until this one is sent
+        self.previous_statement_id = cursor.get_statement_id()
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.done = False
+        self.stopped = None  # 'timeout' or 'cancelled' once a stop was requested
+
+    def statement_id(self):
+        """ Server id of the ticket's own statement, None until it is known """
+        statement_id = self.cursor.get_statement_id()
+        return None if statement_id == self.previous_statement_id else statement_id
+
+    def error(self, statement):
+        if self.stopped == 'timeout':
+            return StatementTimeoutException(f"Statement exceeded its timeout of {self.timeout} seconds: {statement}")
+        return StatementCancelledException(f"Statement was cancelled: {statement}")
+
+
+class StatementWatchdog:
+    """ Single daemon thread per engine, stopping statements whose deadline passed """
+
+    def __init__(self, stop_statement):
+        self._stop_statement = stop_statement
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def arm(self, ticket):
+        with self._condition:
+            heapq.heappush(self._heap, (ticket.deadline, next(self._counter), ticket))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sqream-watchdog', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def stop(self, ticket, reason):
+        """ Ask the server to stop the ticket's statement. Returns False if it is not known yet """
+        if ticket.done or ticket.stopped:
+            return True
+        statement_id = ticket.statement_id()
+        if statement_id is None:
+            return False
+        ticket.stopped = reason
+        self._stop_statement(statement_id)
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._condition.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, ticket = heapq.heappop(self._heap)
+            if ticket.done:
+                continue
+            try:
+                stopped = self.stop(ticket, 'timeout')
+            except Exception:
+                stopped = True  # the statement will run to completion, nothing more we can do
+            if not stopped:
+                ticket.deadline = time.monotonic() + RETRY_INTERVAL
+                self.arm(ticket)
+
+
+class GuardedCursor:
+    """ Result cursor of a guarded statement, keeps the ticket alive until the result is closed """
+
+    def __init__(self, cursor, ticket, statement, release):
+        self._cursor = cursor
+        self._ticket = ticket
+        self._statement = statement
+        self._release = release
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _fetch(self, method, *args):
+        try:
+            return method(*args)
+        except Exception as e:
+            if self._ticket.stopped:
+                raise self._ticket.error(self._statement) from e
+            raise
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def close(self):
+        try:
+            self._cursor.close()
+        finally:
+            self._release(self._ticket)
+
+
+def cancel(connection):
+    """
+        Stop the statement currently running (or being fetched) on a SQLAlchemy
+        Connection. Meant to be called from another thread; returns False if
+        nothing is running on it, or its statement hasn't reached the server yet
+    """
+
+    ticket = connection.info.get(RUNNING_KEY)
+    if ticket is None or ticket.done:
+        return False
+    return connection.dialect.watchdog.stop(ticket, 'cancelled')
+
+
+async def execute_cancellable(connection, statement, parameters=None):
+    """
+        Execute and fetch all rows in a worker thread. Cancelling the awaiting
+        task stops the statement on the server, so the thread is freed promptly
+    """
+
+    task = asyncio.ensure_future(asyncio.to_thread(lambda: connection.execute(statement, parameters).fetchall()))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        cancel(connection)
+        try:
+            await task
+        except Exception:
+            pass
+        raise
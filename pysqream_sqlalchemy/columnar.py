@@ -0,0 +1,205 @@
+"""
+    Column-at-a-time decoding of results into NumPy arrays.
+
+    pysqream hands SQLAlchemy one tuple of Python objects per row. fetch_columns()
+    reads the result's cursor in batches, bypassing Row construction, and converts
+    every column at once with the column_processor() of its SQream type:
+
+        DATE            datetime64[D]
+        DATETIME        datetime64[ms]
+        NUMERIC         float64, scaled int64 or Decimal objects, following numeric_as
+        BOOL            bool, masked where NULL
+        ARRAY           ArrayColumn, the items of all rows in one flat array plus offsets
+
+    Integer and float columns become int64 / float64 arrays (masked integers when
+    they hold NULLs), text columns object arrays.
+
+        with engine.connect() as conn:
+            columns = fetch_columns(conn.execute(select(trades)))
+"""
+
+from decimal import Decimal
+from datetime import date, datetime
+from itertools import chain
+
+from sqlalchemy.types import Integer
+
+from pysqream_sqlalchemy.base import (SqreamArray, SqreamBoolean, SqreamDate, SqreamDateTime, SqreamNumeric,
+                                      _masked_column, DEFAULT_BUFFER_BYTES, UNBOUNDED_WIDTH, rows_per_buffer)
+
+
+DEFAULT_BATCH_SIZE = 100_000
+
+
+def _default_column(values):
+    import numpy as np
+
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, bool):
+        return _masked_column(values, bool, False)
+    if isinstance(sample, int):
+        return _masked_column(values, np.int64, 0)
+    if isinstance(sample, float):
+        return np.array(values, dtype=np.float64)
+    return np.array(values, dtype=object)
+
+
+class ArrayColumn:
+    """
+        Column of arrays as one flat NumPy buffer holding the items of all rows plus
+        offsets: row i is values[offsets[i]:offsets[i + 1]]. NULL arrays are masked in
+        mask, NULL items are masked in values. tolist() gives the rows back as lists,
+        which is what bulk inserts of array columns take
+    """
+
+    def __init__(self, values, offsets, mask=None):
+        import numpy as np
+
+        self.values = values
+        self.offsets = offsets
+        self.mask = mask if mask is not None else np.zeros(len(offsets) - 1, dtype=bool)
+
+    @classmethod
+    def from_lists(cls, rows, item_processor=None):
+        import numpy as np
+
+        lengths = np.fromiter((0 if row is None else len(row) for row in rows), dtype=np.int64, count=len(rows))
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        items = list(chain.from_iterable(row for row in rows if row is not None))
+        values = (item_processor or _default_column)(items)
+        mask = np.fromiter((row is None for row in rows), dtype=bool, count=len(rows))
+        return cls(values, offsets, mask)
+
+    @classmethod
+    def concatenate(cls, columns):
+        import numpy as np
+
+        concatenate = np.ma.concatenate if any(isinstance(column.values, np.ma.MaskedArray) for column in columns) \
+            else np.concatenate
+        values = concatenate([column.values for column in columns])
+        offsets = [columns[0].offsets[:1]]
+        base = 0
+        for column in columns:
+            offsets.append(column.offsets[1:] + base)
+            base += column.offsets[-1]
+        return cls(values, np.concatenate(offsets), np.concatenate([column.mask for column in columns]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if self.mask[idx]:
+            return None
+        return self.values[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def tolist(self):
+        return [None if self.mask[idx] else self.values[self.offsets[idx]:self.offsets[idx + 1]].tolist()
+                for idx in range(len(self))]
+
+
+def _type_from_values(values):
+    """ Statements compiled without result columns (text()), pick the type from the Python values """
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, list):
+        return SqreamArray(_type_from_values(list(chain.from_iterable(value for value in values if value))) or Integer())
+    if isinstance(sample, bool):
+        return SqreamBoolean()
+    if isinstance(sample, datetime):
+        return SqreamDateTime()
+    if isinstance(sample, date):
+        return SqreamDate()
+    if isinstance(sample, Decimal):
+        return SqreamNumeric()
+    return None
+
+
+def result_types(result):
+    """ Types of the result columns from the compiled result map, None for text() statements """
+    dialect = result.context.dialect
+    result_columns = getattr(result.context.compiled, '_result_columns', None) or []
+    if len(result_columns) != len(result.keys()):
+        return None
+    return [dialect.type_descriptor(column.type) for column in result_columns]
+
+
+def batch_size_for(result):
+    """ Rows per fetch sized from the declared column widths, or from the sizes in the cursor description """
+    types = result_types(result)
+    if types is not None:
+        return rows_per_buffer(types, DEFAULT_BATCH_SIZE)
+    widths = [(col[3] if len(col) > 3 and isinstance(col[3], int) and col[3] > 0 else UNBOUNDED_WIDTH) + 1
+              for col in result.cursor.description]
+    return max(1, min(DEFAULT_BATCH_SIZE, DEFAULT_BUFFER_BYTES // (sum(widths) or 1)))
+
+
+def column_processors(result, first_batch):
+    """ One column-at-a-time processor per result column, from the compiled result map if there is one """
+    dialect = result.context.dialect
+    types = result_types(result)
+    if types is None:
+        types = [_type_from_values([row[idx] for row in first_batch]) for idx in range(len(result.keys()))]
+
+    processors = []
+    for type_ in types:
+        column_processor = getattr(type_, 'column_processor', None)
+        processors.append(column_processor(dialect) if column_processor is not None else _default_column)
+    return processors
+
+
+def fetch_columns(result, batch_size=None):
+    """
+        Fetch the rest of a result as {column name: NumPy array}, the result is closed
+        afterwards. Without a batch_size, batches are sized from the column widths
+    """
+    import numpy as np
+
+    names = list(result.keys())
+    batch_size = batch_size or batch_size_for(result)
+    cursor = result.cursor
+    batches = [[] for _ in names]
+    processors = None
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if processors is None:
+                processors = column_processors(result, rows)
+            for idx, values in enumerate(zip(*rows)):
+                batches[idx].append(processors[idx](list(values)))
+    finally:
+        result.close()
+
+    columns = {}
+    for name, arrays in zip(names, batches):
+        if not arrays:
+            columns[name] = np.array([], dtype=object)
+        elif len(arrays) == 1:
+            columns[name] = arrays[0]
+        elif isinstance(arrays[0], ArrayColumn):
+            columns[name] = ArrayColumn.concatenate(arrays)
+        elif any(isinstance(array, np.ma.MaskedArray) for array in arrays):
+            columns[name] = np.ma.concatenate(arrays)
+        else:
+            columns[name] = np.concatenate(arrays)
+    return columns
+
+
+def read_dataframe(result, batch_size=None):
+    """
+        fetch_columns() as a pandas DataFrame, masked columns become nullable pandas
+        arrays and array columns hold one NumPy view into the flat buffer per row
+    """
+    import numpy as np
+    import pandas as pd
+
+    data = {}
+    for name, column in fetch_columns(result, batch_size).items():
+        if isinstance(column, np.ma.MaskedArray):
+            masked_array = pd.arrays.BooleanArray if column.dtype == bool else pd.arrays.IntegerArray
+            column = masked_array(column.data, np.ma.getmaskarray(column))
+        elif isinstance(column, ArrayColumn):
+            column = np.array([column[idx] for idx in range(len(column))] + [None], dtype=object)[:-1]
+        data[name] = column
+    return pd.DataFrame(data, copy=False)
@@ -0,0 +1,237 @@
+"""
+    Compiled statement cache that survives the process.
+
+    SQLAlchemy's statement cache lives in memory, so short-lived processes
+    (Airflow tasks, CLI jobs) compile every statement again on each start. With
+    create_engine(url, compiled_cache_path=directory) every statement the
+    SqreamSQLCompiler compiles is also written to the directory, keyed by its
+    cache key and the dialect version. A fresh process restores the SQL string,
+    bind names and result column map from there instead of compiling.
+
+    Tables, columns and bound parameters are stored as references into the
+    statement being compiled, so an entry is small and is restored against the
+    caller's own Table objects. Statements whose cache key can't be pickled
+    (e.g. lambda statements) and ORM statements, whose compile state refers to
+    the mappers, are compiled as usual.
+
+    Entries are pickles, so whoever can write to the directory can run code in
+    every process using it. The directory has to be owned by the current user
+    and not writable by group or others, otherwise the engine refuses it, and
+    entry files that are writable by others are never loaded.
+"""
+
+import copyreg
+import hashlib
+import io
+import os
+import pickle
+import stat
+import threading
+import weakref
+
+import sqlalchemy
+from sqlalchemy import util
+from sqlalchemy.sql import elements
+from sqlalchemy.sql.schema import Column, Table
+
+
+CACHE_FORMAT = 1
+
+# taken from the statement being compiled when restoring
+_EXCLUDED_ATTRIBUTES = ('dialect', 'preparer', 'statement', 'cache_key', '_cached_metadata', '_bind_processors')
+# only read back by the engine for INSERT, UPDATE and DELETE
+_DML_ATTRIBUTES = ('compile_state',)
+
+_dialect_version = None
+
+# Table -> (number of columns, repr), repr of a wide table costs more than compiling a statement over it
+_table_identities = weakref.WeakKeyDictionary()
+
+
+def dialect_version():
+    """ Changes with SQLAlchemy's version and with the source of the SQream compilers and dialect """
+    global _dialect_version
+    if _dialect_version is None:
+        from pysqream_sqlalchemy import base, ddl, dialect
+
+        digest = hashlib.sha256(f"{sqlalchemy.__version__}:{CACHE_FORMAT}".encode())
+        for module in (base, ddl, dialect):
+            with open(module.__file__, 'rb') as source:
+                digest.update(source.read())
+        _dialect_version = digest.hexdigest()
+    return _dialect_version
+
+
+def _is_private(st):
+    """ Owned by the current user and not writable by anybody else """
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _table_identity(table):
+    known = _table_identities.get(table)
+    if known is None or known[0] != len(table.c):
+        known = _table_identities[table] = len(table.c), repr(table)
+    return known[1]
+
+
+def _reduce_table(table):
+    return str, (_table_identity(table),)
+
+
+def _reduce_symbol(symbol):
+    return util.symbol, (symbol.name,)
+
+
+class _KeyPickler(pickle.Pickler):
+    """ Pickles a cache key, Tables by their definition since they are compared by identity in memory """
+
+    dispatch_table = {**copyreg.dispatch_table, Table: _reduce_table, util.symbol: _reduce_symbol}
+
+
+class _StatePickler(pickle.Pickler):
+    """ Pickles a compiled statement, referring to the parts of the statement it was compiled from """
+
+    dispatch_table = {**copyreg.dispatch_table, util.symbol: _reduce_symbol}
+
+    def __init__(self, file, statement, bindparams):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._statement = statement
+        self._binds = {id(bind): idx for idx, bind in enumerate(bindparams)}
+        self._selected = {id(column): idx for idx, column in enumerate(getattr(statement, '_raw_columns', ()))}
+
+    def persistent_id(self, obj):
+        if obj is self._statement:
+            return 'statement',
+        if isinstance(obj, elements.BindParameter) and id(obj) in self._binds:
+            return 'bind', self._binds[id(obj)]
+        if id(obj) in self._selected:
+            return 'selected', self._selected[id(obj)]
+        if isinstance(obj, Table):
+            return 'table', obj.fullname
+        if isinstance(obj, Column) and isinstance(obj.table, Table):
+            return 'column', obj.table.fullname, obj.key
+        return None
+
+
+def _key_tables(key):
+    """ The Tables of a statement by name, found in its cache key rather than by traversing it """
+    tables = {}
+    pending = [key]
+    while pending:
+        item = pending.pop()
+        if type(item) is tuple:
+            pending.extend(item)
+        elif isinstance(item, Table):
+            tables[item.fullname] = item
+    return tables
+
+
+class _StateUnpickler(pickle.Unpickler):
+    def __init__(self, file, statement, cache_key):
+        super().__init__(file)
+        self._statement = statement
+        self._bindparams = cache_key.bindparams
+        self._key = cache_key.key
+        self._tables = None
+
+    def persistent_load(self, pid):
+        kind = pid[0]
+        if kind == 'statement':
+            return self._statement
+        if kind == 'bind':
+            return self._bindparams[pid[1]]
+        if kind == 'selected':
+            return self._statement._raw_columns[pid[1]]
+        if self._tables is None:
+            self._tables = _key_tables(self._key)
+        if kind == 'table':
+            return self._tables[pid[1]]
+        if kind == 'column':
+            return self._tables[pid[1]].c[pid[2]]
+        raise pickle.UnpicklingError(f"Unknown reference {pid}")
+
+
+def _is_orm(compiled):
+    compile_state = getattr(compiled, 'compile_state', None)
+    return compile_state is not None and type(compile_state).__module__.startswith('sqlalchemy.orm')
+
+
+class DurableCompiledCache:
+    """
+        Directory of compiled statements, shared by all processes of the same dialect
+        version and user. Raises ValueError for a directory others can write to
+    """
+
+    suffix = '.sql.pickle'
+
+    def __init__(self, path):
+        self.path = path
+        self.loads = 0
+        self.stores = 0
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        if not _is_private(os.stat(path)):
+            raise ValueError(f"compiled_cache_path {path} must be owned by the current user "
+                             "and not writable by group or others")
+
+    def _file(self, name):
+        return os.path.join(self.path, name + self.suffix)
+
+    def __len__(self):
+        return len([name for name in os.listdir(self.path) if name.endswith(self.suffix)])
+
+    @staticmethod
+    def entry_name(dialect, cache_key, column_keys, for_executemany):
+        """ File name of a compiled statement, None if its cache key can't be stored """
+        identity = (type(dialect).__module__, type(dialect).__qualname__, dialect.paramstyle, dialect.label_length,
+                    dialect_version(), tuple(column_keys or ()), for_executemany)
+        buffer = io.BytesIO()
+        try:
+            _KeyPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump((identity, cache_key.key))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return None
+        return hashlib.sha256(buffer.getvalue()).hexdigest()
+
+    def restore(self, compiled, name, statement, cache_key):
+        """ Fill compiled in from the stored entry, False when there is none """
+        try:
+            with open(self._file(name), 'rb') as source:
+                if not _is_private(os.fstat(source.fileno())):
+                    return False  # replaced by our own entry once compiled
+                state = _StateUnpickler(source, statement, cache_key).load()
+        except FileNotFoundError:
+            return False
+        except Exception:
+            return False  # truncated, or not matching this statement after all; compiled and stored again
+        compiled.compile_state = None
+        compiled.__dict__.update(state)
+        compiled.statement = statement
+        compiled.cache_key = cache_key
+        self.loads += 1
+        return True
+
+    def store(self, compiled, name, statement, cache_key):
+        if _is_orm(compiled):
+            return
+        is_dml = compiled.isinsert or compiled.isupdate or compiled.isdelete
+        excluded = _EXCLUDED_ATTRIBUTES if is_dml else _EXCLUDED_ATTRIBUTES + _DML_ATTRIBUTES
+        state = {attr: value for attr, value in compiled.__dict__.items() if attr not in excluded}
+        buffer = io.BytesIO()
+        try:
+            _StatePickler(buffer, statement, cache_key.bindparams).dump(state)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        tmp_path = f"{self._file(name)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as sink:
+            sink.write(buffer.getvalue())
+        os.replace(tmp_path, self._file(name))
+        self.stores += 1
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith(self.suffix):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
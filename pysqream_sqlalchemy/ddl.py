@@ -0,0 +1,75 @@
+"""
+    SQream specific DDL constructs, rendered by SqreamDDLCompiler.
+"""
+
+from sqlalchemy import Column, MetaData, Table
+from sqlalchemy.schema import CreateTable, ExecutableDDLElement
+from sqlalchemy.sql import coercions, roles
+
+
+class CreateForeignTable(CreateTable):
+    """
+        CREATE FOREIGN TABLE over files that are queried in place. wrapper is the
+        foreign data wrapper or just the file format ('parquet', 'orc', 'csv',
+        'json', 'avro'), options are rendered as OPTIONS next to LOCATION:
+
+            events = Table('events', metadata, Column('id', Integer), Column('payload', Text))
+            conn.execute(CreateForeignTable(events, 'parquet', 's3://bucket/events/*.parquet',
+                                            options={'aws_id': key, 'aws_secret': secret}))
+
+        The table's columns are reflected like those of any other table
+    """
+
+    __visit_name__ = 'create_foreign_table'
+
+    def __init__(self, element, wrapper, location, options=None, or_replace=False):
+        super().__init__(element)
+        self.wrapper = wrapper if wrapper.endswith('_fdw') else f'{wrapper}_fdw'
+        self.location = location
+        self.options = dict(options or {})
+        self.or_replace = or_replace
+
+
+class CreateTableAs(ExecutableDDLElement):
+    """
+        CREATE TABLE ... AS SELECT, materializing a query inside SQream instead of
+        moving its rows through Python:
+
+            totals = CreateTableAs('daily_totals', select(events.c.day, func.count().label('events'))
+                                   .group_by(events.c.day))
+            conn.execute(totals)
+            conn.execute(select(totals.table))
+
+        .table has the columns of the select. Parameters of the select are rendered inline
+    """
+
+    __visit_name__ = 'create_table_as'
+
+    def __init__(self, name, select, schema=None, or_replace=False):
+        self.select = coercions.expect(roles.SelectStatementRole, select)
+        self.element = Table(name, MetaData(),
+                             *(Column(column.key, column.type) for column in self.select.selected_columns),
+                             schema=schema)
+        self.or_replace = or_replace
+
+    @property
+    def table(self):
+        return self.element
+
+
+class Truncate(ExecutableDDLElement):
+    """
+        TRUNCATE TABLE, removing all rows at once. Unlike a DELETE without a WHERE
+        clause it leaves no delete predicates behind for a later cleanup, which
+        makes it the way to empty staging tables between loads:
+
+            conn.execute(Truncate(staging))
+
+        table is a Table or a table name
+    """
+
+    __visit_name__ = 'truncate'
+
+    def __init__(self, table, schema=None, restart_identity=False):
+        self.element = table if isinstance(table, Table) else Table(table, MetaData(), schema=schema)
+        self.restart_identity = restart_identity
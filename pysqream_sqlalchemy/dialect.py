@@ -1,28 +1,82 @@
+import importlib.abc
+import importlib.util
 import re
+import sys
+import threading
+from functools import partial
+from time import perf_counter
+from sqlalchemy.engine import reflection
 from sqlalchemy.engine.default import DefaultDialect
-from sqlalchemy.types import Boolean, SmallInteger, Integer, BigInteger, Float, Date, DateTime, String, Unicode, Numeric
-from pysqream_sqlalchemy.base import SqreamSQLCompiler, SqreamTypeCompiler, TINYINT, SqreamDDLCompiler
+from sqlalchemy.types import ARRAY, Boolean, SmallInteger, Integer, BigInteger, Float, Date, DateTime, String, Unicode, Numeric
+from pysqream_sqlalchemy.base import (SqreamSQLCompiler, SqreamTypeCompiler, TINYINT, SqreamDDLCompiler,
+                                      SqreamExecutionContext, SESSION_KEY, PooledSession, SessionCursor, SqreamBoolean,
+                                      SqreamDate, SqreamDateTime, SqreamNumeric, SqreamArray, check_numeric_as)
+from pysqream_sqlalchemy.cancellation import (RUNNING_KEY, GuardedCursor, StatementTimeoutException, StatementWatchdog,
+                                              Ticket)
+from pysqream_sqlalchemy.cache import (SCHEMA_GENERATION, CachedResult, MemoryResultCache, SingleFlight, WriteTracker,
+                                       make_cache_key, read_tables, written_tables)
+from pysqream_sqlalchemy.compiled_cache import DurableCompiledCache
+from pysqream_sqlalchemy.instrumentation import Instrumentation, SlowQueryLog, SqreamQueuePool
+from pysqream_sqlalchemy.reflection_snapshot import ReflectionSnapshot
+from pysqream_sqlalchemy.saved_queries import (DEFAULT_CAPACITY, SAVED_QUERY_OPTION, SavedQueries,
+                                               drop_saved_query_sql, execute_saved_query_sql, save_query_sql,
+                                               saved_query_name)
 from sqlalchemy.dialects import registry
-from sqlalchemy import text
+from sqlalchemy.schema import Column, Table
+from sqlalchemy import event, exc, text, util
+from sqlalchemy.sql import sqltypes
 
 
-try:
-    from alembic.ddl.impl import DefaultImpl
-except ImportError:
-    pass
-else:
-    class SQreamImpl(DefaultImpl):
-        """ Allows Alembic tool to recognize the dialect if installed """
+class _AlembicImplLoader:
+    """ Loader of alembic.ddl that defines the SQream impl right after it """
+
+    def __init__(self, loader):
+        self._loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._loader.exec_module(module)
+        import pysqream_sqlalchemy.alembic_impl  # noqa: F401
+
 
-        __dialect__ = 'sqream'
+class _AlembicImplFinder(importlib.abc.MetaPathFinder):
+    """
+        Alembic finds impls by dialect name among the DefaultImpl subclasses defined so far,
+        and importing it for every engine is slow. Defines the SQream impl once anything
+        imports alembic.ddl, which Alembic does before it looks an impl up
+    """
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != 'alembic.ddl':
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(fullname)
+        if spec is not None and spec.loader is not None:
+            spec.loader = _AlembicImplLoader(spec.loader)
+        return spec
+
+
+def _register_alembic_impl():
+    """ Make the SQream impl known to Alembic, now if Alembic is loaded, or else once it is """
+    if 'alembic.ddl' in sys.modules:
+        import pysqream_sqlalchemy.alembic_impl  # noqa: F401
+    elif not any(isinstance(finder, _AlembicImplFinder) for finder in sys.meta_path):
+        sys.meta_path.insert(0, _AlembicImplFinder())
 
 
 registry.register("pysqream", "dialect", "SqreamDialect")
+registry.register("sqream", "pysqream_sqlalchemy.dialect", "SqreamDialect")  # sqream_* Table / Column kwargs
+_register_alembic_impl()
 
 
 sqream_to_alchemy_types = {
-    'bool':      Boolean,
-    'boolean':   Boolean,
+    'bool':      SqreamBoolean,
+    'boolean':   SqreamBoolean,
     'ubyte':     TINYINT,
     'tinyint':   TINYINT,
     'smallint':  SmallInteger,
@@ -32,34 +86,66 @@ sqream_to_alchemy_types = {
     'float':     Float,
     'double':    Float,
     'real':      Float,
-    'date':      Date,
-    'datetime':  DateTime,
-    'timestamp': DateTime,
+    'date':      SqreamDate,
+    'datetime':  SqreamDateTime,
+    'timestamp': SqreamDateTime,
     'varchar':   String,
     'nvarchar':  Unicode,
     'text':      Unicode,
-    'numeric':   Numeric,
-    # 'bool[]':      ARRAY,
-    # 'boolean[]':   ARRAY,
-    # 'ubyte[]':     ARRAY,
-    # 'tinyint[]':   ARRAY,
-    # 'smallint[]':  ARRAY,
-    # 'int[]':       ARRAY,
-    # 'integer[]':   ARRAY,
-    # 'bigint[]':    ARRAY,
-    # 'float[]':     ARRAY,
-    # 'double[]':    ARRAY,
-    # 'real[]':      ARRAY,
-    # 'date[]':      ARRAY,
-    # 'datetime[]':  ARRAY,
-    # 'timestamp[]': ARRAY,
-    # 'varchar[]':   ARRAY,
-    # 'nvarchar[]':  ARRAY,
-    # 'text[]':      ARRAY,
-    # 'numeric[]':   ARRAY,
+    'numeric':   SqreamNumeric,
 }
 
 
+_COLUMN_TYPE_RE = re.compile(r"\s*(\w+)\s*(?:\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\))?\s*(\[\])?")
+
+
+def is_values_insert(statement, context=None):
+    """ INSERT ... VALUES, sent through the bulk insert path. INSERT ... SELECT runs as a regular statement """
+    compiled = context.compiled if context is not None else None
+    if getattr(compiled, 'isinsert', False):
+        return compiled.statement.select is None
+    return bool(_VALUES_INSERT_RE.match(statement))
+
+
+def parse_column_type(col_spec):
+    """ 'numeric(38,10) not null' -> ('numeric', (38, 10), False), the flag is set for arrays """
+    match = _COLUMN_TYPE_RE.match(col_spec)
+    if match is None:
+        raise ValueError(f"No column type in {col_spec!r}")
+    type_args = tuple(int(arg) for arg in match.group(2, 3) if arg is not None)
+    return match.group(1).lower(), type_args, match.group(4) is not None
+
+
+def reflected_type(type_key, type_args=()):
+    """ Type instance of a reflected column, with its length or precision and scale """
+    col_type = sqream_to_alchemy_types[type_key]
+    if type_args and issubclass(col_type, String):
+        return col_type(type_args[0])
+    if type_args and issubclass(col_type, Numeric) and not issubclass(col_type, Float):
+        return col_type(*type_args)
+    return col_type()
+
+
+_VALUES_INSERT_RE = re.compile(r'\s*insert\s+into\s+[^(]+(?:\([^)]*\))?\s*values\b', re.IGNORECASE)
+_DDL_HEADER_RE = re.compile(r'\s*create\s+(?:or\s+replace\s+)?(foreign\s+)?table\s+"?([^".\s]+)"?\.', re.IGNORECASE)
+_COMPRESSION_RE = re.compile(r"""check\s*\(\s*'cs\s+"([^"]+)"'\s*\)""", re.IGNORECASE)
+_CLUSTER_BY_RE = re.compile(r"\bcluster\s+by\s+([^;]+)", re.IGNORECASE)
+
+
+def parse_compression(col_spec):
+    """ Compression of a column from its CHECK('CS "..."') spec, None when the server picks it """
+    match = _COMPRESSION_RE.search(col_spec)
+    return match.group(1) if match else None
+
+
+def parse_cluster_by(table_ddl):
+    """ Cluster keys of a table from its DDL """
+    match = _CLUSTER_BY_RE.search(table_ddl)
+    if match is None:
+        return []
+    return [key.strip().strip('"') for key in match.group(1).split(',') if key.strip()]
+
+
 def printdbg(message, dbg=False):
 
     if dbg:
@@ -86,10 +172,48 @@ class SqreamDialect(DefaultDialect):
     type_compiler = SqreamTypeCompiler
     statement_compiler = SqreamSQLCompiler
     ddl_compiler = SqreamDDLCompiler
+    construct_arguments = [
+        (Table, {'cluster_by': None}),
+        (Column, {'compression': None}),
+    ]
+    execution_ctx_cls = SqreamExecutionContext
+    poolclass = SqreamQueuePool
+    colspecs = {
+        ARRAY: SqreamArray,
+        Boolean: SqreamBoolean,
+        Date: SqreamDate,
+        DateTime: SqreamDateTime,
+        Float: Float,  # keeps Float, a Numeric subclass, out of SqreamNumeric
+        Numeric: SqreamNumeric,
+    }
     Tinyint = TINYINT
 
-    def __init__(self, **kwargs):
+    def __init__(self, result_cache=None, single_flight=False, slow_query_log=None, service_pool_size=2,
+                 session_parameters=None, numeric_as=None, saved_query_capacity=DEFAULT_CAPACITY,
+                 compiled_cache_path=None, reflection_snapshot_path=None, **kwargs):
         super().__init__(**kwargs)
+        self.result_cache = result_cache
+        self.single_flight = single_flight
+        self._in_flight = SingleFlight()
+        self.write_tracker = WriteTracker()
+        self.instrumentation = Instrumentation()
+        self.slow_query_log = slow_query_log if slow_query_log is not None else SlowQueryLog()
+        self.schema_version = 0
+        self.watchdog = StatementWatchdog(self._stop_statement)
+        self.service_pool_size = service_pool_size
+        self.session_parameters = dict(session_parameters) if session_parameters is not None else None
+        self.numeric_as = check_numeric_as(numeric_as)
+        self.saved_queries = SavedQueries(saved_query_capacity)
+        self.durable_compiled_cache = DurableCompiledCache(compiled_cache_path) if compiled_cache_path else None
+        self.reflection_snapshot = ReflectionSnapshot(reflection_snapshot_path) if reflection_snapshot_path else None
+        self._service_pools = {}
+        self._service_pools_lock = threading.Lock()
+        self._connect_params = None
+
+    @classmethod
+    def engine_created(cls, engine):
+        """ engine.dispose() also closes the service sub-pools """
+        event.listen(engine, 'engine_disposed', lambda disposed: disposed.dialect.dispose_service_pools())
 
     @classmethod
     def import_dbapi(cls):
@@ -102,12 +226,113 @@ class SqreamDialect(DefaultDialect):
         setattr(pysqream, "Error", ConnectionError)
         return pysqream
 
+    def create_connect_args(self, url):
+        """ numeric_as can be given in the URL query, it is a dialect option and not passed to pysqream """
+        if 'numeric_as' in url.query:
+            self.numeric_as = check_numeric_as(url.query['numeric_as'])
+            url = url.difference_update_query(['numeric_as'])
+        return super().create_connect_args(url)
+
+    def connect(self, *cargs, **cparams):
+        """ Remembers the final connect arguments, so helpers can open side connections """
+        self._connect_params = (cargs, cparams)
+        return super().connect(*cargs, **cparams)
+
+    def open_side_connection(self, **overrides):
+        """
+            Open a DB-API connection outside the engine's pool, with the same arguments
+            the pool uses. Keyword arguments override single connect arguments
+        """
+        if self._connect_params is None:
+            raise exc.InvalidRequestError("Engine must be connected at least once before opening side connections")
+        cargs, cparams = self._connect_params
+        return super().connect(*cargs, **{**cparams, **overrides})
+
+    def service_pool(self, service):
+        """
+            Pool of connections to another SQream service queue, used for statements with
+            the sqream_service execution option. Sub-pools are created on first use and hold
+            at most service_pool_size connections. None for the engine's own service
+        """
+        if self._connect_params is None or service == self._connect_params[1].get('service'):
+            return None
+        with self._service_pools_lock:
+            pool = self._service_pools.get(service)
+            if pool is None:
+                pool = self._service_pools[service] = SqreamQueuePool(
+                    partial(self.open_side_connection, service=service), pool_size=self.service_pool_size,
+                    max_overflow=0, dialect=self)
+        return pool
+
+    def dispose_service_pools(self):
+        """ Close the connections of all service sub-pools, engine.dispose() calls it """
+        with self._service_pools_lock:
+            pools, self._service_pools = list(self._service_pools.values()), {}
+        for pool in pools:
+            pool.dispose()
+
+    def session_cursor(self, connection):
+        """
+            Cursor for a statement on a pooled connection. With session_parameters, the
+            connection's PooledSession cursor is lent out and only parameters that changed
+            since it was last used are sent. While it is busy with another open result, a
+            one-off session gets all the parameters
+        """
+        if self.session_parameters is None:
+            return connection.cursor()
+
+        info = connection.info
+        session = info.get(SESSION_KEY)
+        if session is not None and not session.in_use and not session.applied.keys() <= self.session_parameters.keys():
+            self._close_session(info, session)  # a parameter was removed, start over from the server defaults
+            session = None
+        if session is None:
+            session = info[SESSION_KEY] = PooledSession(connection.cursor())
+        elif session.in_use:
+            session = PooledSession(connection.cursor())
+
+        session.in_use = True
+        try:
+            session.apply(self.session_parameters)
+        except Exception:
+            session.broken = True
+            self._release_session(info, session)
+            raise
+        return SessionCursor(session, partial(self._release_session, info))
+
+    def _release_session(self, info, session):
+        session.in_use = False
+        if session.broken or info.get(SESSION_KEY) is not session:
+            self._close_session(info, session)
+
+    @staticmethod
+    def _close_session(info, session):
+        if info.get(SESSION_KEY) is session:
+            del info[SESSION_KEY]
+        try:
+            session.cursor.close()
+        except Exception:
+            pass
+
     def initialize(self, connection):
         self.default_schema_name = 'public'
 
+    def _reflected(self, connection, kind, name, kw, reflect):
+        """ reflect() through the reflection snapshot, when there is one and an Inspector is asking """
+        snapshot = self.reflection_snapshot
+        info_cache = kw.get('info_cache')
+        if snapshot is None or info_cache is None:
+            return reflect()
+        snapshot.validate(connection, info_cache, self.schema_version)
+        return snapshot.get(kind, name, reflect)
+
     def get_table_names(self, connection, schema=None, **kw):
         """ Allows showing table names when connecting database to Apache Superset """
         schema = connection.dialect.default_schema_name if schema is None else schema
+        return self._reflected(connection, 'tables', schema, kw, partial(self._fetch_table_names, connection, schema))
+
+    @staticmethod
+    def _fetch_table_names(connection, schema):
         query = text("select * from sqream_catalog.tables")
         tables = connection.execute(query).fetchall()
         query = text("select * from sqream_catalog.external_tables")
@@ -127,6 +352,10 @@ class SqreamDialect(DefaultDialect):
 
     def get_view_names(self, connection, schema=None, **kw):
         schema = connection.dialect.default_schema_name if schema is None else schema
+        return self._reflected(connection, 'views', schema, kw, partial(self._fetch_view_names, connection, schema))
+
+    @staticmethod
+    def _fetch_view_names(connection, schema):
         # 0,public.fuzz
         return [schema_view.split(".", 1)[1] for idx, schema_view in connection.execute(text("select get_views()")).fetchall() if schema_view.split(".", 1)[0] == schema]
 
@@ -143,28 +372,35 @@ class SqreamDialect(DefaultDialect):
             when trying to add a new table to the sources
         """
 
-        query = text(f'select get_ddl(\'"{table_name}"\')')
-        res = connection.execute(query).fetchall()
-        table_ddl = ''.join(tup[0] for tup in res).splitlines()
+        table_ddl = self._get_table_ddl(connection, table_name, schema, **kwargs).splitlines()
 
-        schema = table_ddl[0].split()[2].split('.')[0]
+        header = _DDL_HEADER_RE.match(table_ddl[0]) if table_ddl else None
+        if header is None:
+            raise Exception(f'Cannot reflect {table_name}, unexpected get_ddl() output: {table_ddl[:1]}. '
+                            'Perhaps get_ddl() implementation change?')
+        schema = header.group(2)
         columns_meta = []
 
-        # 1st (0) entry is "create table", last 4 are closing parantheses and other jib
-        for col in table_ddl[1:-4]:
-            if col == ')':
+        # 1st (0) entry is "create table", last 4 are closing parantheses and other jib.
+        # Foreign tables are followed by their wrapper and options, column lines end at ')'
+        col_lines = table_ddl[1:] if header.group(1) else table_ddl[1:-4]
+        for col in col_lines:
+            if col.strip().startswith(')'):
                 break
             col_meta = col.split('"')
             col_name = col_meta[1]
+            col_spec = '"'.join(col_meta[2:])
             try:
-                type_key = col_meta[2].split()[0].split('(')[0]
-                if "[]" in type_key:
-                    raise TypeError(f"Arrays have not supported yet. Column {col_name} has type {type_key}.")
-                col_type = sqream_to_alchemy_types[type_key]
-            except KeyError as e:
-                raise Exception(f'key {type_key} not found. Perhaps get_ddl() implementation change? ** col meta {col_meta}')
-
-            col_nullable = col_meta[2] == 'null' 
+                type_key, type_args, is_array = parse_column_type(col_spec)
+                col_type = reflected_type(type_key, type_args)
+            except (KeyError, ValueError):
+                util.warn(f"Did not recognize type {col_spec.strip()!r} of column {col_name!r}")
+                col_type = sqltypes.NULLTYPE
+            else:
+                if is_array:
+                    col_type = SqreamArray(col_type)
+
+            col_nullable = re.search(r"\bnot\s+null\b", col_spec, re.IGNORECASE) is None
             c = {
                 'name': col_name,
                 'schema': schema,
@@ -172,25 +408,298 @@ class SqreamDialect(DefaultDialect):
                 'nullable': col_nullable,
                 'default': None
                 }
+            compression = parse_compression(col_spec)
+            if compression is not None:
+                c['dialect_options'] = {'sqream_compression': compression}
             columns_meta.append(c)       # add default extraction if exists in sqream
 
         return columns_meta
 
+    def get_table_options(self, connection, table_name, schema=None, **kw):
+        cluster_by = parse_cluster_by(self._get_table_ddl(connection, table_name, schema, **kw))
+        return {'sqream_cluster_by': cluster_by} if cluster_by else {}
+
+    @reflection.cache
+    def _get_table_ddl(self, connection, table_name, schema=None, **kw):
+        name = (self.default_schema_name if schema is None else schema, table_name)
+        return self._reflected(connection, 'ddl', name, kw,
+                               partial(self._fetch_table_ddl, connection, table_name, schema))
+
+    @staticmethod
+    def _fetch_table_ddl(connection, table_name, schema=None):
+        qualified = f'"{table_name}"' if schema is None else f'"{schema}"."{table_name}"'
+        query = text(f'select get_ddl(\'{qualified}\')')
+        res = connection.execute(query).fetchall()
+        return ''.join(tup[0] for tup in res)
+
     def do_executemany(self, cursor, statement, parameters, context=None):
         """
             SQream doesn't support insert queries with multiple value patterns (?, ?), (?, ?)
         """
+        self._run_instrumented(self._executemany, cursor, statement, parameters, context, many=True)
+
+    def do_execute(self, cursor, statement, parameters, context=None):
+        self._run_instrumented(self._dispatch_execute, cursor, statement, parameters, context)
+
+    def _run_instrumented(self, execute, cursor, statement, parameters, context=None, many=False):
+        """ Collect statement stats when somebody listens, or when the statement has a slow query threshold """
+        slow_query_ms = context.execution_options.get('sqream_slow_query_ms') if context is not None else None
+        if not self.instrumentation.enabled and not slow_query_ms:
+            return self._run_guarded(execute, cursor, statement, parameters, context)
+
+        on_finish = None
+        if slow_query_ms:
+            on_finish = partial(self.slow_query_log.check, threshold_ms=slow_query_ms,
+                                dbapi_connection=context.root_connection.connection.dbapi_connection)
+        started = perf_counter()
+        stats = self.instrumentation.start(statement, parameters, context, many=many, on_finish=on_finish)
+        try:
+            self._run_guarded(execute, cursor, statement, parameters, context)
+        except Exception as e:
+            self.instrumentation.failed(stats, e, started)
+            raise
+        self.instrumentation.executed(stats, cursor, context, started)
+
+    def _run_guarded(self, execute, cursor, statement, parameters, context=None):
+        """
+            Registers the running statement on its connection for cancel(), and hands
+            it to the watchdog when it has a timeout execution option. A result keeps
+            the statement registered until its cursor is closed
+        """
+        if context is None:
+            return execute(cursor, statement, parameters, context)
+
+        info = context.root_connection.connection.info
+        ticket = Ticket(cursor, context.execution_options.get('timeout'))
+        info[RUNNING_KEY] = ticket
+        if ticket.timeout:
+            self.watchdog.arm(ticket)
+        try:
+            execute(cursor, statement, parameters, context)
+        except Exception as e:
+            self._release_ticket(info, ticket)
+            if ticket.stopped:
+                raise ticket.error(statement) from e
+            raise
+
+        if context.cursor is cursor and cursor.description is not None:
+            context.cursor = GuardedCursor(cursor, ticket, statement, partial(self._release_ticket, info))
+        else:
+            self._release_ticket(info, ticket)  # no result, or replayed from a materialized one
+
+    @staticmethod
+    def _release_ticket(info, ticket):
+        ticket.done = True
+        if info.get(RUNNING_KEY) is ticket:
+            del info[RUNNING_KEY]
+
+    def _stop_statement(self, statement_id):
+        """ Stop a running statement from a side connection, the statement's own one is busy """
+        conn = self.open_side_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"select stop_statement({int(statement_id)})")
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+
+    def do_execute_no_params(self, cursor, statement, context=None):
+        self.do_execute(cursor, statement, None, context)
+
+    def _dispatch_execute(self, cursor, statement, parameters, context=None):
+        cache_ttl = context.execution_options.get('sqream_cache_ttl') if context is not None else None
+        if cache_ttl:
+            self._execute_cached(cursor, statement, parameters, context, cache_ttl)
+        elif self.single_flight and context is not None and re.match(r"\s*(select|with)\b", statement, re.IGNORECASE) \
+                and not context.execution_options.get('stream_results') and not context.execution_options.get('yield_per'):
+            self._execute_single_flight(cursor, statement, parameters, context)
+        else:
+            self._execute(cursor, statement, parameters, context)
+
+    def _executemany(self, cursor, statement, parameters, context=None):
         statement = re.match(r"^.+VALUES.+?\)", statement).group()
         if isinstance(parameters, list):
             cursor.executemany(statement, parameters)
         else:
             cursor.executemany(statement, parameters, data_as='alchemy_flat_list')
-
-    def do_execute(self, cursor, statement, parameters, context=None):
-        if statement.lower().startswith('insert') and '?' in statement:
-            self.do_executemany(cursor, statement, parameters, context)
+        self._record_writes(statement, context)
+
+    def _execute(self, cursor, statement, parameters, context=None):
+        if is_values_insert(statement, context) and '?' in statement:
+            self._executemany(cursor, statement, parameters, context)
+        elif context is not None and context.execution_options.get(SAVED_QUERY_OPTION) and \
+                re.match(r"\s*(select|with)\b", statement, re.IGNORECASE):
+            self._execute_saved(cursor, statement, parameters, context)
+        elif parameters and getattr(context, 'compiled', None) is not None and \
+                getattr(context.compiled, 'saved_query', False):
+            # same cache key as a saved query statement, but executed without the option
+            raise NotSupportedException("Where clause of parameterized query not supported on SQream")
         else:
             cursor.execute(statement, parameters)
+            self._record_writes(statement, context)
+
+    def _execute_saved(self, cursor, statement, parameters, context):
+        """
+            Run the statement as a server-side saved query, saving it first when it is
+            new and dropping the least recently used ones that no longer fit
+        """
+        cache_key = getattr(context.compiled, 'cache_key', None)
+        key = cache_key.key if cache_key is not None else statement
+        # raises for values without a literal, before anything is saved or dropped
+        own_name = saved_query_name(statement)
+        execute_sql = execute_saved_query_sql(own_name, parameters)
+        name, save, evicted = self.saved_queries.acquire(key, statement)
+        if name != own_name:
+            execute_sql = execute_saved_query_sql(name, parameters)  # saved under the name of an equal statement
+        for old_name in evicted:
+            try:
+                cursor.execute(drop_saved_query_sql(old_name))
+            except Exception:
+                pass  # already dropped, e.g. by another process
+
+        save_error = None
+        if save:
+            try:
+                cursor.execute(save_query_sql(name, statement))
+            except Exception as e:
+                save_error = e  # most likely saved before by another process, under the same name
+        try:
+            cursor.execute(execute_sql)
+        except Exception as e:
+            if save:
+                self.saved_queries.discard(key)  # saved again on the next execution
+                if save_error is not None:
+                    raise save_error from e
+                raise
+            self._resave_and_execute(cursor, key, name, statement, execute_sql)
+
+    def _resave_and_execute(self, cursor, key, name, statement, execute_sql):
+        """ Saved queries are shared by name, another process may have dropped this one. Save it once more """
+        try:
+            cursor.execute(save_query_sql(name, statement))
+            cursor.execute(execute_sql)
+        except Exception:
+            self.saved_queries.discard(key)
+            raise
+
+    def drop_saved_queries(self, connection):
+        """ Drop all queries this engine saved on the server """
+        cursor = connection.connection.dbapi_connection.cursor()
+        try:
+            for name in self.saved_queries.clear():
+                try:
+                    cursor.execute(drop_saved_query_sql(name))
+                except Exception:
+                    pass
+        finally:
+            cursor.close()
+
+    def _record_writes(self, statement, context=None):
+        """ Tell the write tracker which tables the statement changed, and bump the schema version on DDL """
+        compiled = context.compiled if context is not None else None
+        tables = getattr(compiled, 'write_tables', None) or written_tables(statement)
+        self.write_tracker.record(tables)
+        ddl = re.match(r"\s*(create|drop|alter|truncate)\b", statement, re.IGNORECASE) is not None
+        if ddl:
+            self.schema_version += 1
+        if getattr(self.result_cache, 'shared', False) and (tables or ddl):
+            self.result_cache.record(frozenset(tables) | {SCHEMA_GENERATION} if ddl else tables)
+
+    def _execute_cached(self, cursor, statement, parameters, context, ttl):
+        """
+            Serve SELECTs from the result cache. A miss executes as usual, then
+            materializes the result and hands the replay cursor to SQLAlchemy
+        """
+        if self.result_cache is None:
+            self.result_cache = MemoryResultCache()
+        key = self._result_key(statement, parameters, context)
+
+        entry = self.result_cache.get(key)
+        if entry is not None:
+            cursor.close()
+            context.cursor = entry.cursor()
+            return
+
+        entry = self._execute_materialized(cursor, statement, parameters, context, ttl, key)
+        if entry is not None:
+            self.result_cache.set(key, entry)
+
+    def _execute_materialized(self, cursor, statement, parameters, context, ttl=None, key=None):
+        """
+            Execute and fetch the whole result, SQLAlchemy then reads it from a replay cursor.
+            With single_flight, identical cached statements already running in this process
+            are not sent again: the callers wait for the first one and share its rows
+        """
+        def run():
+            self._execute(cursor, statement, parameters, context)
+            if cursor.description is None:
+                return None
+            return CachedResult.from_cursor(cursor, ttl)
+
+        if self.single_flight:
+            entry, executed = self._wait_in_flight(key or self._result_key(statement, parameters, context), run,
+                                                   statement=statement, context=context)
+            if entry is None and not executed:
+                entry = run()  # the first caller failed or returned no rows, run our own statement
+        else:
+            entry = run()
+
+        if entry is not None:
+            cursor.close()
+            context.cursor = entry.cursor()
+        return entry
+
+    def _execute_single_flight(self, cursor, statement, parameters, context):
+        """
+            Identical statements already running in this process are not sent again, the
+            callers wait for the first one. Its result is fetched into columns and fanned
+            out to replay cursors only when somebody is waiting, otherwise it is read from
+            the server cursor as usual
+        """
+        def run():
+            self._execute(cursor, statement, parameters, context)
+            return cursor
+
+        def share(executed):
+            return None if executed.description is None else CachedResult.from_cursor_columns(executed)
+
+        entry, executed = self._wait_in_flight(self._result_key(statement, parameters, context), run, share,
+                                               statement=statement, context=context)
+        if entry is None and not executed:
+            self._execute(cursor, statement, parameters, context)  # the first caller failed or returned no rows
+        elif entry is not None and entry is not cursor:
+            cursor.close()
+            context.cursor = entry.cursor()
+
+    def _wait_in_flight(self, key, run, share=None, statement=None, context=None):
+        """ SingleFlight.do(), a caller waiting for an identical statement keeps to its own timeout option """
+        timeout = context.execution_options.get('timeout') if context is not None else None
+        try:
+            return self._in_flight.do(key, run, share, timeout=timeout or None)
+        except TimeoutError as e:
+            raise StatementTimeoutException(f"Statement exceeded its timeout of {timeout} seconds: {statement}") from e
+
+    def _result_key(self, statement, parameters, context=None):
+        """
+            Includes the write counters of the tables read, so writes through this engine invalidate
+            dependent results. A cache shared between processes keeps generations of its own instead
+        """
+        compiled = context.compiled if context is not None else None
+        tables = getattr(compiled, 'read_tables', None) or read_tables(statement)
+        service = context.execution_options.get('sqream_service') if context is not None else None
+        if getattr(self.result_cache, 'shared', False):
+            versions = self.result_cache.versions(frozenset(tables) | {SCHEMA_GENERATION})
+        else:
+            versions = self.schema_version, self.write_tracker.versions(tables)
+        return make_cache_key(statement, parameters, self._connection_identity(service), versions)
+
+    def _connection_identity(self, service=None):
+        if self._connect_params is None:
+            return None
+        cparams = {**self._connect_params[1], **({'service': service} if service is not None else {})}
+        return tuple(cparams.get(param) for param in ('host', 'port', 'database', 'username', 'service'))
 
     def _get_server_version_info(self, connection):
 
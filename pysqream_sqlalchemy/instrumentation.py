@@ -0,0 +1,365 @@
+"""
+    Per statement timing for the SQream dialect.
+
+    Every engine has an Instrumentation object at engine.dialect.instrumentation.
+    Once a listener is registered, each statement executed through the engine
+    produces a StatementStats, which is handed to the listeners when the
+    statement is done: right after execution for statements without a result,
+    when the result's cursor is closed for SELECTs.
+
+        engine.dialect.instrumentation.add_listener(print)
+"""
+
+import json
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from time import perf_counter, time
+from typing import Callable, Optional
+
+from sqlalchemy.pool import QueuePool
+
+
+CHECKOUT_WAIT_KEY = 'sqream_checkout_wait'
+
+
+class SqreamQueuePool(QueuePool):
+    """ QueuePool that remembers how long the last checkout waited, for the statement stats """
+
+    def _do_get(self):
+        start = perf_counter()
+        record = super()._do_get()
+        record.info[CHECKOUT_WAIT_KEY] = perf_counter() - start
+        return record
+
+
+@dataclass
+class StatementStats:
+    """
+        Timings of a single statement, in seconds. compile_time is 0 when the
+        compiled form came from SQLAlchemy's statement cache, checkout_wait is
+        only reported for the first statement after a pool checkout.
+        first_row_time is measured from the start of execution
+    """
+
+    statement: str
+    parameter_rows: int = 0
+    compile_time: float = 0.0
+    checkout_wait: float = 0.0
+    execute_time: float = 0.0
+    first_row_time: Optional[float] = None
+    fetch_time: float = 0.0
+    rows: int = 0
+    bytes: int = 0
+    statement_id: Optional[int] = None
+    error: Optional[BaseException] = None
+    started_at: float = field(default_factory=time)
+    on_finish: Optional[Callable] = field(default=None, repr=False, compare=False)
+
+    @property
+    def total_time(self) -> float:
+        return self.compile_time + self.checkout_wait + self.execute_time + self.fetch_time
+
+
+def _parameter_rows(statement, parameters, many):
+    if not parameters:
+        return 0
+    if not many:
+        return 1
+    if isinstance(parameters, list):
+        return len(parameters)
+    placeholders = statement.count('?')
+    return len(parameters) // placeholders if placeholders else 0  # SQLAlchemy flat list
+
+
+def _row_bytes_estimator(description):
+    """
+        Bytes of a fetched batch: fixed size columns by their declared size,
+        variable length ones by the length of their values
+    """
+    fixed = 0
+    variable = []
+    for idx, col in enumerate(description):
+        size = col[3] if len(col) > 3 else None
+        if isinstance(size, int) and size > 0:
+            fixed += size
+        else:
+            variable.append(idx)
+
+    def estimate(rows):
+        total = fixed * len(rows)
+        for idx in variable:
+            total += sum(len(row[idx]) for row in rows if isinstance(row[idx], (str, bytes)))
+        return total
+
+    return estimate
+
+
+class InstrumentedCursor:
+    """ Wraps a DB-API cursor to time fetches and count rows and bytes """
+
+    def __init__(self, cursor, stats, instrumentation, started):
+        self._cursor = cursor
+        self._stats = stats
+        self._instrumentation = instrumentation
+        self._started = started
+        self._estimate = _row_bytes_estimator(cursor.description)
+        self._finished = False
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _fetched(self, rows, start):
+        end = perf_counter()
+        stats = self._stats
+        stats.fetch_time += end - start
+        if rows:
+            if stats.first_row_time is None:
+                stats.first_row_time = end - self._started
+            stats.rows += len(rows)
+            stats.bytes += self._estimate(rows)
+
+    def fetchone(self):
+        start = perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched([row] if row is not None else [], start)
+        return row
+
+    def fetchmany(self, size=None):
+        start = perf_counter()
+        rows = self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+        self._fetched(rows, start)
+        return rows
+
+    def fetchall(self):
+        start = perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(rows, start)
+        return rows
+
+    def close(self):
+        try:
+            self._cursor.close()
+        finally:
+            if not self._finished:
+                self._finished = True
+                self._instrumentation.finish(self._stats)
+
+
+class Instrumentation:
+    """ Collects StatementStats for an engine and dispatches them to listeners """
+
+    def __init__(self):
+        self._listeners = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._listeners)
+
+    def add_listener(self, fn):
+        """ fn(stats) is called with a StatementStats once every statement is done """
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        self._listeners.remove(fn)
+
+    def start(self, statement, parameters, context=None, many=False, on_finish=None) -> StatementStats:
+        """ on_finish(stats) is called before the listeners, for this statement only """
+        stats = StatementStats(statement, parameter_rows=_parameter_rows(statement, parameters, many),
+                               on_finish=on_finish)
+        if context is None:
+            return stats
+
+        compiled = context.compiled
+        if compiled is not None and context.cache_hit != context.dialect.CACHE_HIT:
+            stats.compile_time = getattr(compiled, 'compile_time', 0.0)
+        connection = context.root_connection.connection
+        stats.checkout_wait = connection.info.pop(CHECKOUT_WAIT_KEY, 0.0)
+        return stats
+
+    def executed(self, stats, cursor, context, started):
+        """ Called after a successful execute, the result cursor (if any) is timed from here on """
+        stats.execute_time = perf_counter() - started
+        get_statement_id = getattr(cursor, 'get_statement_id', None)
+        stats.statement_id = get_statement_id() if get_statement_id is not None else None
+
+        result_cursor = context.cursor if context is not None else cursor
+        if context is not None and result_cursor.description is not None:
+            context.cursor = InstrumentedCursor(result_cursor, stats, self, started)
+        else:
+            stats.rows = stats.parameter_rows
+            self.finish(stats)
+
+    def failed(self, stats, error, started):
+        stats.execute_time = perf_counter() - started
+        stats.error = error
+        self.finish(stats)
+
+    def finish(self, stats):
+        if stats.on_finish is not None:
+            stats.on_finish(stats)
+        for fn in list(self._listeners):
+            fn(stats)
+
+
+class SlowQueryLog:
+    """
+        Bounded in-memory ring buffer of statements that ran longer than their
+        sqream_slow_query_ms execution option, optionally appended to a JSONL file.
+        Every entry holds the SQL, the shape of its parameters, the timings, the
+        SQream statement ID and the plan returned by show_node_info() for it
+    """
+
+    def __init__(self, capacity=1000, path=None):
+        self.path = path
+        self._entries = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def check(self, stats, threshold_ms, dbapi_connection=None):
+        """ Log stats if the statement took at least threshold_ms milliseconds in total """
+        if stats.total_time * 1000 < threshold_ms:
+            return
+        entry = {
+            'logged_at': time(),
+            'statement': stats.statement,
+            'parameters': {'rows': stats.parameter_rows, 'columns': stats.statement.count('?')},
+            'timings': {
+                'compile_time': stats.compile_time,
+                'checkout_wait': stats.checkout_wait,
+                'execute_time': stats.execute_time,
+                'first_row_time': stats.first_row_time,
+                'fetch_time': stats.fetch_time,
+            },
+            'total_time': stats.total_time,
+            'rows': stats.rows,
+            'bytes': stats.bytes,
+            'statement_id': stats.statement_id,
+            'error': repr(stats.error) if stats.error is not None else None,
+            'plan': None,
+        }
+        if dbapi_connection is not None and stats.statement_id is not None:
+            try:
+                entry['plan'] = self.capture_plan(dbapi_connection, stats.statement_id)
+            except Exception as e:
+                entry['plan_error'] = repr(e)
+        self.record(entry)
+
+    @staticmethod
+    def capture_plan(dbapi_connection, statement_id):
+        """ Rows of show_node_info() for a statement, on a separate cursor """
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"select show_node_info({int(statement_id)})")
+            return [list(row) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def record(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+            if self.path is not None:
+                with open(self.path, 'a') as sink:
+                    sink.write(json.dumps(entry, default=str) + '\n')
+
+
+class PrometheusExporter:
+    """
+        Listener that aggregates statement stats into counters and per phase
+        summaries, rendered in the Prometheus text format (or OpenMetrics).
+
+            exporter = PrometheusExporter()
+            engine.dialect.instrumentation.add_listener(exporter)
+            exporter.start_http_server(9464)
+    """
+
+    phases = ('compile', 'checkout', 'execute', 'first_row', 'fetch')
+
+    def __init__(self, namespace='sqream_sqlalchemy'):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self.statements = 0
+        self.errors = 0
+        self.rows = 0
+        self.bytes = 0
+        self._phase_sum = dict.fromkeys(self.phases, 0.0)
+        self._phase_count = dict.fromkeys(self.phases, 0)
+
+    def __call__(self, stats):
+        phase_times = {
+            'compile': stats.compile_time,
+            'checkout': stats.checkout_wait,
+            'execute': stats.execute_time,
+            'first_row': stats.first_row_time,
+            'fetch': stats.fetch_time,
+        }
+        with self._lock:
+            self.statements += 1
+            self.errors += stats.error is not None
+            self.rows += stats.rows
+            self.bytes += stats.bytes
+            for phase, seconds in phase_times.items():
+                if seconds is not None:
+                    self._phase_sum[phase] += seconds
+                    self._phase_count[phase] += 1
+
+    def render(self, openmetrics=False) -> str:
+        counters = (
+            ('statements', 'Statements executed', self.statements),
+            ('statement_errors', 'Statements that raised an error', self.errors),
+            ('rows', 'Rows fetched or sent', self.rows),
+            ('bytes', 'Approximate bytes fetched', self.bytes),
+        )
+        lines = []
+        with self._lock:
+            for name, help_text, value in counters:
+                metric = f'{self.namespace}_{name}'
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric if openmetrics else metric + "_total"} counter')
+                lines.append(f'{metric}_total {value}')
+
+            metric = f'{self.namespace}_phase_seconds'
+            lines.append(f'# HELP {metric} Time spent per statement phase')
+            lines.append(f'# TYPE {metric} summary')
+            for phase in self.phases:
+                lines.append(f'{metric}_sum{{phase="{phase}"}} {self._phase_sum[phase]}')
+                lines.append(f'{metric}_count{{phase="{phase}"}} {self._phase_count[phase]}')
+
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(self, port, addr=''):
+        """ Serve render() on every path from a daemon thread, returns the server """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+                body = exporter.render(openmetrics=openmetrics).encode()
+                content_type = ('application/openmetrics-text; version=1.0.0' if openmetrics
+                                else 'text/plain; version=0.0.4')
+                self.send_response(200)
+                self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((addr, port), Handler)
+        threading.Thread(target=server.serve_forever, name='sqream-metrics', daemon=True).start()
+        return server
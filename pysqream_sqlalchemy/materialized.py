@@ -0,0 +1,96 @@
+"""
+    Client-managed materialized aggregates.
+
+    SQream has no materialized views, so dashboards running heavy GROUP BY
+    queries recompute them from the raw data on every request. A
+    MaterializedAggregate keeps the result of such a select in a summary table
+    created with CREATE TABLE AS, and refreshes it incrementally: only the
+    partitions of refresh_key from the last materialized one on are recomputed
+    and inserted with INSERT ... SELECT, so the data never leaves the server.
+
+        daily = MaterializedAggregate('daily_events', select(events.c.day, func.count().label('events'))
+                                      .group_by(events.c.day), refresh_key='day')
+        daily.refresh(engine)  # creates the table on first use
+        daily.route(engine)    # executing the base select now reads the summary table
+
+    refresh_key must be one of the grouping columns, and new rows must only
+    arrive for its latest partition or later ones.
+"""
+
+from contextlib import nullcontext
+
+from sqlalchemy import delete, event, func, insert, inspect, literal, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.elements import Label
+
+from pysqream_sqlalchemy.ddl import CreateTableAs
+
+
+def _begin(bind):
+    return bind.begin() if isinstance(bind, Engine) else nullcontext(bind)
+
+
+class MaterializedAggregate:
+    """ Summary table of an aggregate select, refreshed incrementally by refresh_key """
+
+    def __init__(self, name, select_stmt, refresh_key, schema=None):
+        self.select = select_stmt
+        self.refresh_key = refresh_key
+        self._create = CreateTableAs(name, select_stmt, schema=schema)
+        self.table = self._create.table
+        if refresh_key not in self.table.c:
+            raise ValueError(f"refresh_key {refresh_key} is not a column of the select")
+        key_column = select_stmt.selected_columns[refresh_key]
+        self._key_expression = key_column.element if isinstance(key_column, Label) else key_column
+        self._cache_key = select_stmt._generate_cache_key()
+
+    def exists(self, connection):
+        return inspect(connection).has_table(self.table.name, schema=self.table.schema)
+
+    def create(self, bind, replace=False):
+        """ (Re)compute the whole summary table """
+        self._create.or_replace = replace
+        with _begin(bind) as conn:
+            conn.execute(self._create)
+
+    def refresh(self, bind):
+        """
+            Recompute the latest materialized partition of refresh_key and add the newer
+            ones. Creates the summary table when it doesn't exist yet. Returns the
+            partition the refresh started from, None for a full computation
+        """
+        with _begin(bind) as conn:
+            if not self.exists(conn):
+                conn.execute(self._create)
+                return None
+
+            key = self.table.c[self.refresh_key]
+            watermark = conn.execute(select(func.max(key))).scalar()
+            if watermark is None:
+                source = self.select
+            else:
+                conn.execute(delete(self.table).where(key >= literal(watermark, key.type, literal_execute=True)))
+                source = self.select.where(self._key_expression >= literal(watermark, key.type, literal_execute=True))
+            conn.execute(insert(self.table).from_select(list(self.table.c.keys()), source))
+            return watermark
+
+    def matches(self, statement):
+        """ True if statement is the base select, with the same literal values """
+        if not hasattr(statement, '_generate_cache_key'):
+            return False
+        cache_key = statement._generate_cache_key()
+        return cache_key == self._cache_key and \
+            [bind.effective_value for bind in cache_key.bindparams] == \
+            [bind.effective_value for bind in self._cache_key.bindparams]
+
+    def route(self, engine):
+        """ Execute the summary table instead of the base select on engine, from now on """
+        event.listen(engine, 'before_execute', self._route, retval=True)
+
+    def unroute(self, engine):
+        event.remove(engine, 'before_execute', self._route)
+
+    def _route(self, conn, clauseelement, multiparams, params, execution_options):
+        if self.matches(clauseelement):
+            clauseelement = select(self.table)
+        return clauseelement, multiparams, params
@@ -0,0 +1,68 @@
+"""
+    Keyset pagination for large ordered scans.
+
+    Paging with LIMIT/OFFSET makes the server produce and skip every row before
+    the page, so deep pages get slower and slower. Keyset pagination remembers
+    the ordering key of the last row instead, and asks for the rows after it:
+
+        for page in paginate(engine, select(events), ['day', 'id'], page_size=50_000):
+            export(page)
+
+    The keys must be unique together and not NULL. Their last seen values are
+    rendered as literals, which keeps the compiled statement cacheable.
+"""
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.engine import Engine
+
+from pysqream_sqlalchemy.base import inline_literal
+
+
+DEFAULT_PAGE_SIZE = 10_000
+
+
+def keyset_predicate(keys, last_seen):
+    """ (k1, k2, ...) > (v1, v2, ...), expanded into k1 > v1 OR (k1 = v1 AND k2 > v2) ... """
+
+    if len(keys) != len(last_seen):
+        raise ValueError(f"Expected {len(keys)} last seen values, got {len(last_seen)}")
+    clauses = []
+    for idx, key in enumerate(keys):
+        equal = [keys[prev] == inline_literal(last_seen[prev], keys[prev]) for prev in range(idx)]
+        clauses.append(and_(*equal, key > inline_literal(last_seen[idx], key)))
+    return or_(*clauses) if len(clauses) > 1 else clauses[0]
+
+
+def _fetch(bind, query):
+    if isinstance(bind, Engine):
+        with bind.connect() as conn:
+            return conn.execute(query).fetchall()
+    return bind.execute(query).fetchall()
+
+
+def paginate(bind, stmt, keys, page_size=DEFAULT_PAGE_SIZE, start_after=None):
+    """
+        Yield the rows of stmt in pages of page_size rows, ordered by keys, names of
+        stmt's columns. bind is an Engine (a pooled connection is checked out per
+        page) or a Connection. start_after resumes after the given key values, e.g.
+        the keys of the last row a client has seen
+    """
+
+    if page_size < 1:
+        raise ValueError("page_size must be a positive number of rows")
+    if isinstance(keys, str):
+        keys = [keys]
+    source = stmt.subquery()
+    key_columns = [source.c[key] for key in keys]
+    key_indexes = [list(source.c.keys()).index(key) for key in keys]
+    query = select(*source.c).order_by(*key_columns).limit(page_size)
+
+    last_seen = tuple(start_after) if start_after is not None else None
+    while True:
+        page_query = query if last_seen is None else query.where(keyset_predicate(key_columns, last_seen))
+        rows = _fetch(bind, page_query)
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last_seen = tuple(rows[-1][idx] for idx in key_indexes)
@@ -0,0 +1,302 @@
+"""
+    Parallel data movement helpers for SQream.
+
+    A single executemany() on a single connection is bound by one network stream,
+    the helpers here split the work into shards and run them concurrently on
+    several connections.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+from typing import List
+
+from sqlalchemy import MetaData, Table, and_, func, or_, select
+
+from pysqream_sqlalchemy.base import inline_literal, rows_per_buffer
+from pysqream_sqlalchemy.ddl import Truncate
+
+
+DEFAULT_SHARD_SIZE = 100_000
+
+# values range partitions can be computed over, date covers datetime
+RANGE_TYPES = (int, float, Decimal, date)
+
+
+@dataclass
+class ShardStats:
+    """ Timing of a single shard sent by the loader """
+
+    shard: int
+    worker: int
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+
+@dataclass
+class LoadReport:
+    """ Summary of a parallel load, with the per shard statistics """
+
+    table: str
+    connections: int
+    seconds: float = 0.0
+    shards: List[ShardStats] = field(default_factory=list)
+
+    @property
+    def rows(self) -> int:
+        return sum(shard.rows for shard in self.shards)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+
+def _rows_from_arrow(data, shard_size):
+    for batch in data.to_batches(max_chunksize=shard_size):
+        yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+
+def _rows_from_dataframe(data, shard_size):
+    for start in range(0, len(data.index), shard_size):
+        yield list(data.iloc[start:start + shard_size].itertuples(index=False, name=None))
+
+
+def _rows_from_iterable(data, shard_size):
+    rows = iter(data)
+    while True:
+        shard = [tuple(row) for row in islice(rows, shard_size)]
+        if not shard:
+            return
+        yield shard
+
+
+def iter_shards(data, shard_size=DEFAULT_SHARD_SIZE):
+    """
+        Split a pandas DataFrame, a pyarrow Table or an iterable of rows into
+        lists of row tuples, shard_size rows each. Sources are consumed lazily
+    """
+
+    if shard_size < 1:
+        raise ValueError("shard_size must be a positive number of rows")
+    if hasattr(data, "to_batches"):
+        return _rows_from_arrow(data, shard_size)
+    if hasattr(data, "itertuples"):
+        return _rows_from_dataframe(data, shard_size)
+    return _rows_from_iterable(data, shard_size)
+
+
+class ParallelLoader:
+    """
+        Insert shards of rows concurrently over several SQream connections.
+
+        Every worker thread owns one connection and pulls shards from a bounded
+        queue, so a fast producer blocks instead of buffering the whole source
+        in memory. With clustered=True the workers open their own connections
+        through the cluster's load balancer, which spreads them across workers;
+        otherwise connections are checked out of the engine's pool.
+
+        Without a shard_size, shards are sized from the declared (or reflected)
+        widths of the table's columns, so wide rows are sent in smaller shards.
+
+        load(data, truncate=True) empties the table first, for staging tables
+        that are reloaded over and over.
+    """
+
+    def __init__(self, engine, table, connections=4, shard_size=None, queue_size=None,
+                 clustered=False, schema=None):
+        if connections < 1:
+            raise ValueError("connections must be at least 1")
+        self.engine = engine
+        self.connections = connections
+        self.queue_size = queue_size or 2 * connections
+        self.clustered = clustered
+        if not isinstance(table, Table):
+            table = Table(table, MetaData(), schema=schema, autoload_with=engine)
+        self.table = table
+        self.shard_size = shard_size or rows_per_buffer([column.type for column in table.columns], DEFAULT_SHARD_SIZE)
+        self.statement = str(table.insert().compile(dialect=engine.dialect))
+
+    def _open_connection(self):
+        if self.clustered:
+            return self.engine.dialect.open_side_connection(clustered=True)
+        return self.engine.raw_connection()
+
+    def _worker(self, worker_id, shards, report, errors, lock):
+        try:
+            conn = self._open_connection()
+        except Exception as e:
+            errors.append(e)
+            conn = None
+
+        try:
+            while True:
+                item = shards.get()
+                if item is None:
+                    break
+                if errors:
+                    continue  # drain the queue so the producer never blocks forever
+                shard_id, rows = item
+                start = time.perf_counter()
+                try:
+                    cursor = conn.cursor()
+                    try:
+                        self.engine.dialect.do_executemany(cursor, self.statement, rows)
+                    finally:
+                        cursor.close()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                with lock:
+                    report.shards.append(ShardStats(shard_id, worker_id, len(rows), time.perf_counter() - start))
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def load(self, data, truncate=False) -> LoadReport:
+        """ Load all rows of data into the table and return the load statistics """
+
+        if truncate:
+            with self.engine.begin() as conn:
+                conn.execute(Truncate(self.table))
+
+        report = LoadReport(table=self.table.name, connections=self.connections)
+        shards = queue.Queue(maxsize=self.queue_size)
+        errors: List[Exception] = []
+        lock = threading.Lock()
+        workers = [threading.Thread(target=self._worker, args=(worker_id, shards, report, errors, lock),
+                                    name=f"sqream-loader-{worker_id}", daemon=True)
+                   for worker_id in range(self.connections)]
+
+        if self.clustered:
+            with self.engine.connect():
+                pass  # makes sure the dialect knows the engine's connect arguments
+
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        try:
+            for shard_id, rows in enumerate(iter_shards(data, self.shard_size)):
+                if errors:
+                    break
+                shards.put((shard_id, rows))
+        finally:
+            for _ in workers:
+                shards.put(None)
+            for worker in workers:
+                worker.join()
+        report.seconds = time.perf_counter() - start
+
+        if errors:
+            raise errors[0]
+        report.shards.sort(key=lambda shard: shard.shard)
+        return report
+
+
+def parallel_load(engine, table, data, connections=4, shard_size=None, queue_size=None,
+                  clustered=False, schema=None, truncate=False) -> LoadReport:
+    """ Shortcut for ParallelLoader(...).load(data, truncate) """
+
+    loader = ParallelLoader(engine, table, connections=connections, shard_size=shard_size,
+                            queue_size=queue_size, clustered=clustered, schema=schema)
+    return loader.load(data, truncate=truncate)
+
+
+def _check_range_type(python_type, column):
+    if not issubclass(python_type, RANGE_TYPES) or issubclass(python_type, bool):
+        raise ValueError(f"Range partitioning needs a numeric, date or datetime column, {column.name} holds "
+                         f"{python_type.__name__} values. Partition by an integer column with method='modulo' instead")
+
+
+def range_predicates(column, lower, upper, partitions):
+    """
+        Split [lower, upper] of column into contiguous ranges. The last range is
+        closed and also picks up NULL keys, so every row lands in exactly one range
+    """
+
+    for value in (lower, upper):
+        _check_range_type(type(value), column)
+    if lower == upper or partitions == 1:
+        return [or_(column.is_(None), column.isnot(None))]
+
+    if isinstance(lower, int) and isinstance(upper, int):
+        step = max(1, -(-(upper - lower) // partitions))
+    else:
+        step = (upper - lower) / partitions
+    bounds = [lower]
+    while len(bounds) < partitions and bounds[-1] + step < upper:
+        bounds.append(bounds[-1] + step)
+
+    predicates = [and_(column >= inline_literal(low, column), column < inline_literal(high, column))
+                  for low, high in zip(bounds, bounds[1:])]
+    predicates.append(or_(column >= inline_literal(bounds[-1], column), column.is_(None)))
+    return predicates
+
+
+def modulo_predicates(column, partitions):
+    """ Hash an integer column into partitions buckets by its remainder """
+
+    bucket = func.abs(column % inline_literal(partitions, column))
+    predicates = [bucket == inline_literal(part, column) for part in range(partitions)]
+    predicates[-1] = or_(predicates[-1], column.is_(None))
+    return predicates
+
+
+def read_sql_parallel(stmt, engine, partition_column, partitions=4, method="range"):
+    """
+        Run stmt as several partitioned sub-selects on pooled connections and
+        return the union of the results as a single DataFrame.
+
+        method="range" asks the server for the min/max of partition_column and
+        splits it into contiguous ranges, method="modulo" buckets an integer
+        column by its remainder. Each partition is fetched and turned into a
+        DataFrame in its own thread, the partitions are concatenated once at the
+        end. Row order follows the partitions, not the original statement
+    """
+
+    import pandas as pd
+
+    if partitions < 1:
+        raise ValueError("partitions must be at least 1")
+
+    source = stmt.subquery()
+    column = source.c[partition_column]
+
+    if method == "range":
+        try:
+            _check_range_type(column.type.python_type, column)
+        except NotImplementedError:
+            pass  # type unknown before the query, e.g. text() columns, range_predicates checks the values
+        with engine.connect() as conn:
+            lower, upper = conn.execute(select(func.min(column), func.max(column))).one()
+        if lower is None:
+            predicates = [None]
+        else:
+            predicates = range_predicates(column, lower, upper, partitions)
+    elif method == "modulo":
+        predicates = modulo_predicates(column, partitions)
+    else:
+        raise ValueError(f"Unknown partitioning method {method}, use 'range' or 'modulo'")
+
+    def read_partition(predicate):
+        query = select(*source.c)
+        if predicate is not None:
+            query = query.where(predicate)
+        with engine.connect() as conn:
+            result = conn.execute(query)
+            return pd.DataFrame.from_records(result.fetchall(), columns=list(result.keys()))
+
+    with ThreadPoolExecutor(max_workers=len(predicates), thread_name_prefix="sqream-reader") as pool:
+        frames = list(pool.map(read_partition, predicates))
+
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True, copy=False)
@@ -0,0 +1,157 @@
+"""
+    Local snapshot of the catalog reflection.
+
+    MetaData.reflect(engine) asks the server for the DDL of every table, one
+    get_ddl() call each, which adds up to tens of seconds on large catalogs.
+    With create_engine(url, reflection_snapshot_path=file) the dialect keeps the
+    table and view names and the DDL it reflected in file, and serves them from
+    there on the next start.
+
+    Reflection first compares a fingerprint of the catalog with the one the
+    snapshot was taken at: counts and id sums of the tables and columns, and
+    the views. When tables or views were created or dropped, or columns added
+    or dropped, the snapshot is discarded and everything is reflected from the
+    server again. A fingerprint is reused for max_age seconds, so Inspectors
+    created one after the other (Table(autoload_with=...) for each table) don't
+    check the catalog each time. DDL run through the same engine always
+    triggers a new check. Changes that keep the counts, such as renaming a
+    column, need clear().
+
+    The file holds one JSON object per line, a header with the snapshot format
+    and fingerprint followed by the entries, so new entries are appended.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import text
+
+
+SNAPSHOT_FORMAT = 2
+DEFAULT_MAX_AGE = 10.0
+
+FINGERPRINT_QUERIES = (
+    "select count(*), sum(table_id), max(table_id) from sqream_catalog.tables",
+    "select count(*), sum(table_id), max(table_id) from sqream_catalog.external_tables",
+    "select count(*), sum(table_id) from sqream_catalog.columns",
+    "select get_views()",
+)
+
+# marks the info_cache of an Inspector whose reflection was validated against the catalog
+_VALIDATED_KEY = 'sqream_reflection_snapshot'
+
+
+def catalog_fingerprint(connection):
+    """ Digest of the catalog, changes when tables, columns or views are created or dropped """
+    digest = hashlib.sha256()
+    for query in FINGERPRINT_QUERIES:
+        rows = sorted(repr(tuple(row)) for row in connection.execute(text(query)).fetchall())
+        digest.update(query.encode())
+        for row in rows:
+            digest.update(row.encode())
+    return digest.hexdigest()
+
+
+def _name(name):
+    """ JSON turns tuple names, e.g. (schema, table), into lists """
+    return tuple(name) if isinstance(name, list) else name
+
+
+class ReflectionSnapshot:
+    """ Reflected table names, view names and table DDL of a database, kept in a local file """
+
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.fingerprint = None
+        self.checks = 0
+        self._checked = None  # (time.monotonic(), schema version) of the last fingerprint
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as source:
+                lines = source.read().splitlines()
+        except FileNotFoundError:
+            return
+        try:
+            header = json.loads(lines[0])
+            if header.get('format') != SNAPSHOT_FORMAT:
+                return
+            entries = {}
+            for line in lines[1:]:
+                entry = json.loads(line)
+                entries[entry['kind'], _name(entry['name'])] = entry['value']
+        except (IndexError, KeyError, ValueError):
+            return  # truncated or written by something else, reflected again
+        self.fingerprint = header.get('fingerprint')
+        self._entries = entries
+
+    def _header(self):
+        return json.dumps({'format': SNAPSHOT_FORMAT, 'fingerprint': self.fingerprint}) + '\n'
+
+    def _rewrite(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as sink:
+            sink.write(self._header())
+            for (kind, name), value in self._entries.items():
+                sink.write(json.dumps({'kind': kind, 'name': name, 'value': value}) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def validate(self, connection, info_cache, schema_version=0):
+        """
+            Discard the snapshot when the catalog changed since it was taken. Checked once
+            per Inspector, and at most every max_age seconds while schema_version stays
+        """
+        if info_cache.get(_VALIDATED_KEY):
+            return
+        checked = self._checked
+        if checked is not None and checked[1] == schema_version and time.monotonic() - checked[0] < self.max_age:
+            info_cache[_VALIDATED_KEY] = True
+            return
+        fingerprint = catalog_fingerprint(connection)
+        with self._lock:
+            self.checks += 1
+            self._checked = time.monotonic(), schema_version
+            if fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                self._entries = {}
+                self._rewrite()
+        info_cache[_VALIDATED_KEY] = True
+
+    def get(self, kind, name, reflect):
+        """ The snapshot's entry, or reflect() recorded as the entry. name is a string or a tuple of them """
+        with self._lock:
+            if (kind, name) in self._entries:
+                self.hits += 1
+                return self._entries[kind, name]
+        value = reflect()
+        with self._lock:
+            self._entries[kind, name] = value
+            self.misses += 1
+            with open(self.path, 'a', encoding='utf-8') as sink:
+                sink.write(json.dumps({'kind': kind, 'name': name, 'value': value}) + '\n')
+        return value
+
+    def clear(self):
+        """ Forget the snapshot, the next Inspector reflects everything again """
+        with self._lock:
+            self.fingerprint = None
+            self._checked = None
+            self._entries = {}
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,79 @@
+"""
+    Deterministic sampling for interactive exploration.
+
+    SQream has no TABLESAMPLE, so a sample is the set of rows whose key falls
+    into the first buckets of crc64() of its text. The same key always lands in
+    the same bucket, so repeated previews are stable and samples of tables that
+    share a key join consistently.
+
+        events_1pct = tablesample(events, 0.01, key='user_id')
+        count = conn.execute(select(func.count()).select_from(events_1pct)).scalar()
+        estimate = estimate_count(count, 0.01)  # estimate.value ± estimate.margin
+
+    The estimates treat the sample as a Bernoulli sample of the rows, which holds
+    for a unique key unrelated to the measured values. With a key shared by many
+    rows whole groups are sampled together and the real error is larger. margin
+    is the half width of the confidence interval, 95% by default.
+"""
+
+import math
+from dataclasses import dataclass
+
+from sqlalchemy import Text, cast, func, literal, select
+from sqlalchemy.sql.selectable import Select
+
+
+DEFAULT_BUCKETS = 10_000
+Z_95 = 1.96
+
+
+def sample_predicate(column, fraction, buckets=DEFAULT_BUCKETS):
+    """ True for the rows whose key falls into the first fraction of the buckets """
+
+    if not 0 < fraction <= 1:
+        raise ValueError("fraction must be in (0, 1]")
+    bucket = func.abs(func.crc64(cast(column, Text)) % literal(buckets, literal_execute=True))
+    return bucket < literal(max(1, round(fraction * buckets)), literal_execute=True)
+
+
+def tablesample(selectable, fraction, key, buckets=DEFAULT_BUCKETS, name=None):
+    """
+        Subquery of a Table or select() holding the sampled fraction of its rows,
+        sampled by the key column name. Use it like the original table
+    """
+
+    source = selectable.subquery() if isinstance(selectable, Select) else selectable
+    return select(*source.c).where(sample_predicate(source.c[key], fraction, buckets)).subquery(name)
+
+
+@dataclass
+class SampleEstimate:
+    """ Estimate of a population total from a sample, with its margin of error """
+
+    value: float
+    margin: float
+
+    @property
+    def low(self) -> float:
+        return self.value - self.margin
+
+    @property
+    def high(self) -> float:
+        return self.value + self.margin
+
+
+def estimate_total(sample_sum, sample_sum_squares, fraction, z=Z_95) -> SampleEstimate:
+    """
+        Population SUM(x) from SUM(x) and SUM(x * x) over the sample. The variance of
+        the estimate is (1 - fraction) / fraction ** 2 * SUM(x * x)
+    """
+
+    value = sample_sum / fraction
+    margin = z * math.sqrt((1 - fraction) * sample_sum_squares) / fraction
+    return SampleEstimate(value, margin)
+
+
+def estimate_count(sample_count, fraction, z=Z_95) -> SampleEstimate:
+    """ Population COUNT(*) from the number of sampled rows """
+
+    return estimate_total(sample_count, sample_count, fraction, z)
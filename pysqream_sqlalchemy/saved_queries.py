@@ -0,0 +1,107 @@
+"""
+    Server-side saved queries for hot parameterized SELECTs.
+
+    A statement executed with execution_options(sqream_saved_query=True) is
+    compiled with ? placeholders, saved on the server once with save_query()
+    and then run with execute_saved_query(name, values...), so SQream parses and
+    plans it only once. The dialect keeps an LRU of the queries it saved and
+    drops the least recently used one from the server once it holds more than
+    saved_query_capacity of them.
+
+        lookup = select(users).where(users.c.id == bindparam('id')).execution_options(sqream_saved_query=True)
+        conn.execute(lookup, {'id': 42})
+"""
+
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+
+SAVED_QUERY_OPTION = 'sqream_saved_query'
+DEFAULT_CAPACITY = 100
+
+
+def saved_query_name(statement):
+    """ Server-side name of a statement. Equal statements get equal names, across processes too """
+    return 'sqlalchemy_' + hashlib.sha1(statement.encode()).hexdigest()[:24]
+
+
+def render_value(value):
+    """ A bound value as a literal argument of execute_saved_query() """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float) and not math.isfinite(value) or isinstance(value, Decimal) and not value.is_finite():
+        raise ValueError(f"{value} has no SQL literal, saved queries can't take it as a parameter")
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, datetime):
+        return f"'{value.isoformat(sep=' ', timespec='milliseconds')}'"
+    if isinstance(value, date):
+        return f"'{value.isoformat()}'"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def save_query_sql(name, statement):
+    quoted = f"$${statement}$$" if '$$' not in statement else render_value(statement)
+    return f"select save_query({render_value(name)}, {quoted})"
+
+
+def execute_saved_query_sql(name, parameters):
+    arguments = [render_value(name)] + [render_value(value) for value in parameters or ()]
+    return f"select execute_saved_query({', '.join(arguments)})"
+
+
+def drop_saved_query_sql(name):
+    return f"select drop_saved_query({render_value(name)})"
+
+
+class SavedQueries:
+    """
+        LRU of the queries saved on the server, keyed by the compiled cache key
+        (or the SQL when there is none)
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("saved query capacity must be at least 1")
+        self.capacity = capacity
+        self._names = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, key):
+        return key in self._names
+
+    def acquire(self, key, statement):
+        """
+            The saved query name of key, whether it still has to be saved, and the
+            names evicted to make room for it, which should be dropped on the server
+        """
+        with self._lock:
+            name = self._names.get(key)
+            if name is not None:
+                self._names.move_to_end(key)
+                return name, False, []
+            name = self._names[key] = saved_query_name(statement)
+            evicted = []
+            while len(self._names) > self.capacity:
+                evicted.append(self._names.popitem(last=False)[1])
+            return name, True, evicted
+
+    def discard(self, key):
+        with self._lock:
+            self._names.pop(key, None)
+
+    def clear(self):
+        """ Forget all saved queries, returns their names """
+        with self._lock:
+            names = list(self._names.values())
+            self._names.clear()
+            return names
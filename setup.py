@@ -23,9 +23,10 @@ setup_params = dict(
     install_requires=['sqlalchemy==2.0.27',
                       'pysqream>=5.1.0',
                       'setuptools>=57.4.0',
-                      'pandas==2.2.2',
-                      'numpy==1.26.4',
                       'alembic>=1.10.2'],
+
+    extras_require={'numpy': ['numpy==1.26.4'],
+                    'pandas': ['pandas==2.2.2', 'numpy==1.26.4']},
     
     packages=['pysqream_sqlalchemy'],
     
@@ -0,0 +1,311 @@
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+import pytest
+from sqlalchemy import text, create_engine, select, Table, Column, Integer, MetaData
+from test_base import TestBase, Logger
+from pysqream_sqlalchemy.dialect import SqreamDialect
+from pysqream_sqlalchemy.cache import (CachedResult, MemoryResultCache, DiskResultCache, SingleFlight, WriteTracker,
+                                       make_cache_key, read_tables, written_tables)
+
+
+def cached_result(rows, ttl=None):
+    return CachedResult([('i', 'ftInt', 4, 4, 38, 0, True)], rows, None if ttl is None else time.time() + ttl)
+
+
+class TestResultCacheBackends:
+    def test_memory_cache_lru(self):
+        cache = MemoryResultCache(max_entries=2)
+        cache.set('a', cached_result([(1,)]))
+        cache.set('b', cached_result([(2,)]))
+        assert cache.get('a').rows == [(1,)]
+        cache.set('c', cached_result([(3,)]))
+
+        assert cache.get('b') is None
+        assert cache.get('a').rows == [(1,)]
+        assert cache.get('c').rows == [(3,)]
+
+    def test_memory_cache_row_budget(self):
+        cache = MemoryResultCache(max_rows=3)
+        cache.set('a', cached_result([(1,), (2,)]))
+        cache.set('b', cached_result([(3,), (4,)]))
+        cache.set('big', cached_result([(5,)] * 4))
+
+        assert cache.get('a') is None
+        assert cache.get('b') is not None
+        assert cache.get('big') is None
+
+    def test_memory_cache_ttl(self):
+        cache = MemoryResultCache()
+        cache.set('a', cached_result([(1,)], ttl=-1))
+        assert cache.get('a') is None
+
+    def test_disk_cache_roundtrip(self, tmp_path):
+        pytest.importorskip('pyarrow')
+        cache = DiskResultCache(str(tmp_path), max_entries=2)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, cached_result([(1,), (None,)], ttl=60))
+            time.sleep(0.01)
+
+        assert len(cache) == 2
+        assert cache.get('a') is None
+        entry = cache.get('c')
+        assert entry.rows == [(1,), (None,)]
+        assert entry.cursor().fetchall() == [(1,), (None,)]
+
+    def test_disk_cache_shared_by_processes(self, tmp_path):
+        pytest.importorskip('pyarrow')
+        first, second = (SqreamDialect(result_cache=DiskResultCache(str(tmp_path))) for _ in range(2))
+        first._record_writes('insert into t values (1)')
+        cached = first._result_key('select * from t', ())
+        second._record_writes('insert into t values (2)')  # one write each, equal write counters
+
+        assert second._result_key('select * from t', ()) != cached
+        assert first._result_key('select * from t', ()) == second._result_key('select * from t', ())
+        assert first._result_key('select * from other', ()) == second._result_key('select * from other', ())
+
+        before = first._result_key('select * from other', ())
+        second._record_writes('create or replace view v as select 1')
+        assert first._result_key('select * from other', ()) != before
+
+    def test_cache_key(self):
+        assert make_cache_key('select ?', (1,)) == make_cache_key('select ?', (1,))
+        assert make_cache_key('select ?', (1,)) != make_cache_key('select ?', (2,))
+        assert make_cache_key('select 1', (), 0) != make_cache_key('select 1', (), 1)
+
+    def test_cache_key_of_mappings_and_many(self):
+        assert make_cache_key('select :a', {'a': 1}) != make_cache_key('select :a', {'a': 2})
+        assert make_cache_key('select :a, :b', {'a': 1, 'b': 2}) == make_cache_key('select :a, :b', {'b': 2, 'a': 1})
+        assert make_cache_key('insert ?', [[1], [2]]) != make_cache_key('insert ?', [[1], [3]])
+        assert make_cache_key('insert ?', [[1], [2]]) == make_cache_key('insert ?', ((1,), (2,)))
+
+
+class TestResultCache(TestBase):
+    table_name = 'result_cache'
+
+    def test_cached_select(self):
+        Logger().info('Result cache tests')
+        self.session.execute(text(f'create or replace table {self.table_name} (i int)'))
+        self.session.execute(text(f'insert into {self.table_name} values (1), (2)'))
+        query = text(f'select * from {self.table_name} order by i').execution_options(sqream_cache_ttl=60)
+
+        first = self.session.execute(query).fetchall()
+        self.session.execute(text(f'insert into {self.table_name} values (3)'))
+        second = self.session.execute(query).fetchall()
+        uncached = self.session.execute(text(f'select * from {self.table_name} order by i')).fetchall()
+
+        assert first == second == [(1,), (2,)]
+        assert uncached == [(1,), (2,), (3,)]
+
+    def test_ddl_invalidates(self):
+        self.session.execute(text(f'create or replace table {self.table_name} (i int)'))
+        query = text(f'select count(*) from {self.table_name}').execution_options(sqream_cache_ttl=60)
+        assert self.session.execute(query).fetchall() == [(0,)]
+
+        self.session.execute(text(f'create or replace table {self.table_name} (i int)'))
+        self.session.execute(text(f'insert into {self.table_name} values (1)'))
+        assert self.session.execute(query).fetchall() == [(1,)]
+
+    def test_disk_cache_engine(self, tmp_path):
+        pytest.importorskip('pyarrow')
+        engine = create_engine(self.conn_str, result_cache=DiskResultCache(str(tmp_path)))
+        engine = engine.execution_options(sqream_cache_ttl=60)
+        with engine.connect() as conn:
+            first = conn.execute(text('select 1, \'a\'')).fetchall()
+            second = conn.execute(text('select 1, \'a\'')).fetchall()
+        engine.dispose()
+
+        assert first == second == [(1, 'a')]
+        assert len(engine.dialect.result_cache) == 1
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_share_result(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'result'
+
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for _ in range(5)]
+        for follower in followers:
+            follower.start()
+        while len(flight) != 1:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        assert len(calls) == 1
+        assert sorted(results, key=lambda res: not res[1]) == [('result', True)] + [('result', False)] * 5
+        assert len(flight) == 0
+
+    def test_failed_leader(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+
+        with pytest.raises(ValueError):
+            flight.do('key', fail)
+        assert flight.do('key', lambda: 'again') == ('again', True)
+
+    def test_shared_only_when_waited_for(self):
+        flight = SingleFlight()
+        shared = []
+        assert flight.do('key', lambda: 'cursor', shared.append) == ('cursor', True)
+        assert shared == [] and len(flight) == 0
+
+        started, release = threading.Event(), threading.Event()
+        results = []
+
+        def slow():
+            started.set()
+            release.wait()
+            return 'cursor'
+
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', slow, lambda value: f'rows of {value}')))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+        follower.start()
+        while not flight._calls['key'].waiting:
+            time.sleep(0.01)
+        release.set()
+        for thread in (leader, follower):
+            thread.join()
+
+        assert sorted(results, key=lambda res: not res[1]) == [('rows of cursor', True), ('rows of cursor', False)]
+
+    def test_waiting_caller_times_out(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait()
+            return 'result'
+
+        leader = threading.Thread(target=flight.do, args=('key', slow))
+        leader.start()
+        started.wait()
+        with pytest.raises(TimeoutError):
+            flight.do('key', slow, timeout=0.05)
+        assert flight._calls['key'].waiting == 0
+        release.set()
+        leader.join()
+
+    def test_dialect_raises_statement_timeout(self):
+        from pysqream_sqlalchemy.cancellation import StatementTimeoutException
+
+        dialect = SqreamDialect()
+        started, release = threading.Event(), threading.Event()
+        leader = threading.Thread(target=dialect._in_flight.do, args=('key', lambda: started.set() or release.wait()))
+        leader.start()
+        started.wait()
+        context = SimpleNamespace(execution_options={'timeout': 0.05})
+        with pytest.raises(StatementTimeoutException):
+            dialect._wait_in_flight('key', lambda: None, statement='select 1', context=context)
+        release.set()
+        leader.join()
+
+    def test_shared_result_is_columnar(self):
+        class Cursor:
+            description = [('i', 'ftInt', 4, 4, 38, 0, True), ('s', 'ftBlob', 0, 0, 38, 0, True)]
+
+            def __init__(self, rows):
+                self.rows = rows
+
+            def fetchmany(self, size):
+                batch, self.rows = self.rows[:size], self.rows[size:]
+                return batch
+
+        entry = CachedResult.from_cursor_columns(Cursor([(i, str(i)) for i in range(5)]), batch_size=2)
+        assert entry.rows.columns == [[0, 1, 2, 3, 4], ['0', '1', '2', '3', '4']]
+        replay = entry.cursor()
+        assert replay.rowcount == 5
+        assert replay.fetchone() == (0, '0')
+        assert replay.fetchmany(2) == [(1, '1'), (2, '2')]
+        assert replay.fetchall() == [(3, '3'), (4, '4')]
+        assert replay.fetchone() is None
+
+
+class TestSingleFlightEngine(TestBase):
+    def test_concurrent_identical_selects(self):
+        Logger().info('Single-flight tests')
+        engine = create_engine(self.conn_str, single_flight=True, pool_size=8)
+        results = []
+
+        def query():
+            with engine.connect() as conn:
+                results.append(conn.execute(text('select count(*) from sqream_catalog.tables')).fetchall())
+
+        threads = [threading.Thread(target=query) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+        assert len(results) == 8
+        assert all(res == results[0] for res in results)
+
+
+class TestWriteTracking:
+    def test_written_tables(self):
+        assert written_tables('insert into "kOko" values (1)') == {'public.kOko'}
+        assert written_tables('create or replace table crud.Crud_Table (i int)') == {'crud.crud_table'}
+        assert written_tables('DELETE FROM t where i = 1') == {'public.t'}
+        assert written_tables('truncate table s."T"') == {'s.T'}
+        assert written_tables('select * from t') == set()
+
+    def test_read_tables(self):
+        assert read_tables('select * from t1 join "T2" on t1.i = "T2".i') == {'public.t1', 'public.T2'}
+
+    def test_tracker(self):
+        tracker = WriteTracker()
+        seen = []
+        tracker.add_listener(seen.append)
+        before = tracker.versions({'public.a', 'public.b'})
+        tracker.record(frozenset({'public.a'}))
+
+        assert seen == [{'public.a'}]
+        assert tracker.version('public.a') == 1
+        assert tracker.versions({'public.a', 'public.b'}) != before
+        assert tracker.versions({'public.b'}) == (('public.b', 0),)
+
+
+class TestWriteTrackingEngine(TestBase):
+    def test_writes_invalidate_dependent_results(self):
+        Logger().info('Write tracking tests')
+        metadata = MetaData()
+        written = Table('written', metadata, Column('i', Integer))
+        untouched = Table('untouched', metadata, Column('i', Integer))
+        metadata.drop_all(bind=self.engine)
+        metadata.create_all(bind=self.engine)
+        seen = []
+        self.engine.dialect.write_tracker.add_listener(seen.append)
+
+        with self.engine.connect() as conn:
+            conn.execute(untouched.insert().values(i=1))
+            assert conn.execute(select(written).execution_options(sqream_cache_ttl=60)).fetchall() == []
+            conn.execute(text('insert into untouched values (2)'))
+            assert conn.execute(select(written).execution_options(sqream_cache_ttl=60)).fetchall() == []
+            conn.execute(written.insert().values(i=1))
+            assert conn.execute(select(written).execution_options(sqream_cache_ttl=60)).fetchall() == [(1,)]
+            conn.execute(text('delete from written'))
+            assert conn.execute(select(written).execution_options(sqream_cache_ttl=60)).fetchall() == []
+
+        assert seen == [{'public.untouched'}, {'public.untouched'}, {'public.written'}, {'public.written'}]
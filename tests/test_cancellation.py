@@ -0,0 +1,96 @@
+import sys
+import threading
+import time
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import Table, Column, text
+from test_base import TestBase, Logger
+from pysqream_sqlalchemy.cancellation import (StatementCancelledException, StatementTimeoutException,
+                                              StatementWatchdog, Ticket, cancel)
+from pysqream_sqlalchemy.parallel import parallel_load
+
+
+class FakeCursor:
+    def __init__(self, statement_id=None):
+        self.statement_id = statement_id
+
+    def get_statement_id(self):
+        return self.statement_id
+
+
+class TestWatchdog:
+    def test_stops_expired_statements_only(self):
+        stopped = []
+        watchdog = StatementWatchdog(stopped.append)
+        expired, finished = Ticket(FakeCursor(), timeout=0.05), Ticket(FakeCursor(), timeout=0.05)
+        expired.cursor.statement_id, finished.cursor.statement_id = 1, 2
+        watchdog.arm(expired)
+        watchdog.arm(finished)
+        finished.done = True
+        time.sleep(0.3)
+
+        assert stopped == [1]
+        assert expired.stopped == 'timeout'
+        assert isinstance(expired.error('select 1'), StatementTimeoutException)
+
+    def test_retries_until_statement_id_is_known(self):
+        stopped = []
+        cursor = FakeCursor(None)
+        watchdog = StatementWatchdog(stopped.append)
+        watchdog.arm(Ticket(cursor, timeout=0.01))
+        time.sleep(0.05)
+        cursor.statement_id = 7
+        time.sleep(0.3)
+
+        assert stopped == [7]
+
+    def test_ignores_previous_statement_of_reused_cursor(self):
+        stopped = []
+        cursor = FakeCursor(5)  # a pooled cursor, still reporting its last statement
+        watchdog = StatementWatchdog(stopped.append)
+        ticket = Ticket(cursor)
+        assert not watchdog.stop(ticket, 'cancelled')
+        assert ticket.stopped is None
+
+        cursor.statement_id = 6
+        assert watchdog.stop(ticket, 'cancelled')
+        assert stopped == [6]
+
+
+class TestStatementTimeout(TestBase):
+    table_name = 'cancellation'
+
+    def create_table(self):
+        table = Table(self.table_name, self.metadata, Column('i', sa.Integer), extend_existing=True)
+        if self.insp.has_table(table.name):
+            table.drop(bind=self.engine)
+        table.create(bind=self.engine)
+        parallel_load(self.engine, table, ((i,) for i in range(2_000)), connections=1)
+        return table
+
+    def slow_query(self):
+        return text(f'select count(*) from {self.table_name} a, {self.table_name} b, {self.table_name} c')
+
+    def test_timeout(self):
+        Logger().info('Statement timeout stops the statement on the server')
+        self.create_table()
+        with self.engine.connect() as conn:
+            start = time.time()
+            with pytest.raises(StatementTimeoutException):
+                conn.execution_options(timeout=1).execute(self.slow_query()).fetchall()
+            assert time.time() - start < 30
+
+            # the connection is still usable
+            assert conn.execute(text('select 1')).fetchall() == [(1,)]
+
+    def test_cancel_from_another_thread(self):
+        Logger().info('Cooperative cancellation of a running statement')
+        self.create_table()
+        with self.engine.connect() as conn:
+            threading.Timer(1, cancel, args=(conn,)).start()
+            with pytest.raises(StatementCancelledException):
+                conn.execute(self.slow_query()).fetchall()
+            assert not cancel(conn)
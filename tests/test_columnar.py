@@ -0,0 +1,152 @@
+import sys
+from datetime import date, datetime
+from decimal import Decimal
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy import Table, Column, select, text
+from test_base import TestBase, Logger
+from pysqream_sqlalchemy.base import SqreamArray, SqreamBoolean, SqreamDate, SqreamDateTime, SqreamNumeric
+from pysqream_sqlalchemy.columnar import ArrayColumn, fetch_columns, read_dataframe
+
+
+class TestColumnProcessors:
+    def test_column_processors(self):
+        assert SqreamDate().column_processor(None)([date(2024, 1, 2), None]).dtype == np.dtype('datetime64[D]')
+        assert SqreamDateTime().column_processor(None)([datetime(2024, 1, 2, 3, 4, 5, 6000)])[0] == \
+            np.datetime64('2024-01-02T03:04:05.006')
+        assert np.isnan(SqreamNumeric(asdecimal=False).column_processor(None)([Decimal('1.5'), None])[1])
+        booleans = SqreamBoolean().column_processor(None)([True, None, False])
+        assert booleans.dtype == bool and list(np.ma.getmaskarray(booleans)) == [False, True, False]
+
+
+class TestFetchColumns(TestBase):
+    table_name = 'columnar'
+
+    def create_table(self):
+        table = Table(self.table_name, self.metadata, Column('d', sa.Date), Column('dt', sa.DateTime),
+                      Column('n', sa.Numeric(10, 2)), Column('f', sa.Numeric(10, 2, asdecimal=False)),
+                      Column('b', sa.Boolean), Column('i', sa.Integer), extend_existing=True)
+        if self.insp.has_table(table.name):
+            table.drop(bind=self.engine)
+        table.create(bind=self.engine)
+        self.session.execute(table.insert(), [
+            {'d': date(2024, 1, idx + 1), 'dt': datetime(2024, 1, 1, 0, 0, idx), 'n': Decimal(f'{idx}.25'),
+             'f': Decimal(f'{idx}.5'), 'b': idx % 2 == 0, 'i': idx} for idx in range(10)])
+        self.session.commit()
+        return table
+
+    def test_fetch_columns(self):
+        Logger().info('Column-at-a-time decoding of a result')
+        table = self.create_table()
+        with self.engine.connect() as conn:
+            columns = fetch_columns(conn.execute(select(table).order_by(table.c.i)), batch_size=3)
+
+        assert columns['d'].dtype == np.dtype('datetime64[D]')
+        assert columns['dt'].dtype == np.dtype('datetime64[ms]')
+        assert columns['n'][1] == Decimal('1.25')
+        assert columns['f'].dtype == np.float64 and columns['f'][1] == 1.5
+        assert columns['b'].dtype == bool and columns['b'].sum() == 5
+        assert list(columns['i']) == list(range(10))
+
+    def test_read_dataframe_from_text(self):
+        Logger().info('Column types of text statements come from the values')
+        self.create_table()
+        with self.engine.connect() as conn:
+            df = read_dataframe(conn.execute(text(f'select d, dt, i from {self.table_name}')))
+
+        assert str(df['dt'].dtype) == 'datetime64[ms]'
+        assert len(df.index) == 10
+
+
+class TestNumericAsContract:
+    """ Precision contract of numeric_as, see SqreamNumeric """
+
+    class Dialect:
+        numeric_as = None
+
+    def test_float(self):
+        process = SqreamNumeric(38, 10, numeric_as='float').result_processor(self.Dialect(), None)
+        assert process(Decimal('1234.5678901234')) == 1234.5678901234
+        # 20 significant digits do not survive a float64 round trip
+        assert Decimal(repr(process(Decimal('1234567890.1234567891')))) != Decimal('1234567890.1234567891')
+
+    def test_scaled_int(self):
+        process = SqreamNumeric(18, 4, numeric_as='scaled_int').result_processor(self.Dialect(), None)
+        assert process(Decimal('12345678901234.5678')) == 123456789012345678
+        assert process(None) is None
+        column = SqreamNumeric(18, 4, numeric_as='scaled_int').column_processor(self.Dialect())
+        assert column([Decimal('1.5'), None]).dtype == np.int64
+
+    def test_engine_default_and_column_override(self):
+        dialect = self.Dialect()
+        dialect.numeric_as = 'float'
+        assert SqreamNumeric(10, 2).result_processor(dialect, None)(Decimal('1.25')) == 1.25
+        assert SqreamNumeric(10, 2, numeric_as='decimal').result_processor(dialect, None) is None
+        # without a scale there is nothing to scale by, values stay Decimal
+        dialect.numeric_as = 'scaled_int'
+        assert SqreamNumeric().result_processor(dialect, None) is None
+
+
+class TestNumericAs(TestBase):
+    table_name = 'numeric_as'
+
+    def test_numeric_as_url_option(self):
+        Logger().info('numeric_as URL option returns NUMERIC as float')
+        table = Table(self.table_name, self.metadata, Column('n', sa.Numeric(38, 10)), extend_existing=True)
+        if self.insp.has_table(table.name):
+            table.drop(bind=self.engine)
+        table.create(bind=self.engine)
+        self.session.execute(table.insert(), [{'n': Decimal('1.25')}])
+        self.session.commit()
+
+        engine = sa.create_engine(f'{self.conn_str}?numeric_as=float')
+        try:
+            with engine.connect() as conn:
+                assert conn.execute(select(table)).fetchall() == [(1.25,)]
+        finally:
+            engine.dispose()
+
+
+class TestArrayColumn:
+    def test_from_lists_and_back(self):
+        rows = [[1, 2, 3], None, [], [4, None]]
+        column = ArrayColumn.from_lists(rows)
+
+        assert list(column.offsets) == [0, 3, 3, 3, 5]
+        assert list(column.mask) == [False, True, False, False]
+        assert column.values.dtype == np.int64
+        assert column[1] is None and list(column[0]) == [1, 2, 3]
+        assert column.tolist() == rows
+
+    def test_concatenate(self):
+        column = ArrayColumn.concatenate([ArrayColumn.from_lists([[1], [2, 3]]), ArrayColumn.from_lists([None, [4]])])
+        assert column.tolist() == [[1], [2, 3], None, [4]]
+
+
+class TestArrays(TestBase):
+    table_name = 'arrays'
+
+    def test_array_round_trip(self):
+        Logger().info('ARRAY columns: DDL, reflection, inserts and columnar fetch')
+        table = Table(self.table_name, self.metadata, Column('i', sa.Integer),
+                      Column('a', SqreamArray(sa.Integer)), Column('t', SqreamArray(sa.Text)), extend_existing=True)
+        if self.insp.has_table(table.name):
+            table.drop(bind=self.engine)
+        table.create(bind=self.engine)
+
+        reflected = {col['name']: col['type'] for col in self.insp.get_columns(self.table_name)}
+        assert isinstance(reflected['a'], SqreamArray) and isinstance(reflected['a'].item_type, sa.Integer)
+
+        self.session.execute(table.insert(), [{'i': 0, 'a': np.array([1, 2, 3]), 't': ['x']},
+                                              {'i': 1, 'a': None, 't': []}])
+        self.session.commit()
+        rows = self.session.execute(select(table).order_by(table.c.i)).fetchall()
+        assert rows == [(0, [1, 2, 3], ['x']), (1, None, [])]
+
+        with self.engine.connect() as conn:
+            columns = fetch_columns(conn.execute(select(table).order_by(table.c.i)))
+        assert list(columns['a'].values) == [1, 2, 3]
+        assert columns['a'].tolist() == [[1, 2, 3], None]
@@ -0,0 +1,79 @@
+import sys
+import time
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import Table, Column, MetaData, func, literal, select
+from test_base import Logger
+from pysqream_sqlalchemy.dialect import SqreamDialect
+
+
+def statements(count):
+    """ count structurally different reporting selects, over fresh Tables as in a new process """
+    metadata = MetaData()
+    facts = Table('cc_facts', metadata, Column('id', sa.Integer), Column('dim_id', sa.Integer),
+                  *(Column(f'c{i}', sa.Integer) for i in range(20)))
+    dims = Table('cc_dims', metadata, Column('id', sa.Integer), Column('name', sa.Text), Column('region', sa.Text))
+    stmts = []
+    for n in range(count):
+        measures = [facts.c[f'c{i}'] for i in range(n % 20 + 1)]
+        totals = select(facts.c.dim_id, func.sum(facts.c[f'c{n // 20 % 20}']).label('total')) \
+            .group_by(facts.c.dim_id).subquery()
+        stmts.append(
+            select(dims.c.region, func.upper(dims.c.name).label('name'),
+                   sa.case((totals.c.total > literal(100, literal_execute=True), literal('high', literal_execute=True)),
+                           else_=literal('low', literal_execute=True)).label('band'),
+                   *(func.sum(measure).label(f'sum_{measure.key}') for measure in measures))
+            .join_from(facts, dims, facts.c.dim_id == dims.c.id)
+            .join(totals, totals.c.dim_id == dims.c.id)
+            .where(facts.c[f'c{n // 20 % 20}'] > literal(n, literal_execute=True))
+            .group_by(dims.c.region, dims.c.name, totals.c.total)
+            .order_by(dims.c.region).limit(n + 1))
+    return stmts
+
+
+def compile_all(dialect, stmts):
+    """ Compile as a fresh process does, with an empty in-memory statement cache """
+    start = time.perf_counter()
+    compiled = [stmt._compile_w_cache(dialect, compiled_cache={}, column_keys=[])[0] for stmt in stmts]
+    return compiled, time.perf_counter() - start
+
+
+class TestDurableCompiledCache:
+    def test_fresh_process_restores_compiled_sql(self, tmp_path):
+        cold, _ = compile_all(SqreamDialect(compiled_cache_path=str(tmp_path)), statements(5))
+
+        dialect = SqreamDialect(compiled_cache_path=str(tmp_path))
+        stmts = statements(5)
+        warm, _ = compile_all(dialect, stmts)
+
+        assert dialect.durable_compiled_cache.loads == 5
+        assert dialect.durable_compiled_cache.stores == 0
+        assert [compiled.string for compiled in warm] == [compiled.string for compiled in cold]
+        assert warm[0].statement is stmts[0]
+        assert warm[0]._result_columns[0].objects[0] is stmts[0].selected_columns[0]
+        params = warm[3].construct_params(extracted_parameters=statements(5)[3]._generate_cache_key().bindparams)
+        assert sorted(params.values(), key=str) == sorted([3, 4, 100, 'high', 'low'], key=str)
+
+    def test_benchmark_cold_vs_warm(self, tmp_path):
+        _, cold_seconds = compile_all(SqreamDialect(compiled_cache_path=str(tmp_path)), statements(200))
+        _, plain_seconds = compile_all(SqreamDialect(), statements(200))
+        _, warm_seconds = compile_all(SqreamDialect(compiled_cache_path=str(tmp_path)), statements(200))
+        Logger().info(f'200 statements: no durable cache {plain_seconds * 1000:.1f}ms, '
+                      f'cold {cold_seconds * 1000:.1f}ms, warm {warm_seconds * 1000:.1f}ms')
+
+    def test_refuses_shared_directory(self, tmp_path):
+        tmp_path.chmod(0o777)
+        with pytest.raises(ValueError):
+            SqreamDialect(compiled_cache_path=str(tmp_path))
+
+    def test_skips_entries_others_can_write(self, tmp_path):
+        compile_all(SqreamDialect(compiled_cache_path=str(tmp_path)), statements(1))
+        for entry in tmp_path.iterdir():
+            entry.chmod(0o666)
+
+        dialect = SqreamDialect(compiled_cache_path=str(tmp_path))
+        compile_all(dialect, statements(1))
+        assert (dialect.durable_compiled_cache.loads, dialect.durable_compiled_cache.stores) == (0, 1)
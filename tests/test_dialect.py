@@ -13,6 +13,7 @@ import pandas as pd
 import sqlalchemy as sa
 from sqlalchemy import create_engine, select, Table, Column, insert, text, DDL, orm
 from test_base import TestBase, Logger, TestBaseTI
+from pysqream_sqlalchemy.dialect import SqreamDialect
 from alembic.runtime.migration import MigrationContext
 from alembic.operations import Operations
 from datetime import datetime, date
@@ -287,3 +288,161 @@ class TestNew(TestBase):
                 table2.create(bind=self.engine)
             else:
                 raise Exception(e)
+
+
+class TestDataMovement(TestBase):
+    def test_insert_from_select(self):
+        Logger().info('INSERT ... SELECT with parameters runs as a single statement')
+        src = Table('move_src', self.metadata, Column('k', sa.Integer), Column('v', sa.UnicodeText))
+        dst = Table('move_dst', self.metadata, Column('k', sa.Integer), Column('v', sa.UnicodeText))
+        for table in (src, dst):
+            if self.insp.has_table(table.name):
+                table.drop(bind=self.engine)
+            table.create(bind=self.engine)
+
+        with self.engine.begin() as conn:
+            conn.execute(insert(src), [{'k': i, 'v': f'v{i}'} for i in range(10)])
+            for limit in (3, 5):  # the second run hits the compiled cache
+                conn.execute(insert(dst).from_select(['k', 'v'], select(src.c.k, src.c.v).where(src.c.k < limit)))
+            assert conn.execute(select(sa.func.count()).select_from(dst)).scalar() == 8
+
+    def test_create_table_as(self):
+        Logger().info('CREATE TABLE AS materializes a select on the server')
+        from pysqream_sqlalchemy.ddl import CreateTableAs
+        src = Table('move_cta_src', self.metadata, Column('k', sa.Integer), Column('v', sa.UnicodeText))
+        if self.insp.has_table(src.name):
+            src.drop(bind=self.engine)
+        src.create(bind=self.engine)
+
+        create = CreateTableAs('move_cta', select(src.c.v, sa.func.count().label('n')).where(src.c.k > 1)
+                               .group_by(src.c.v), or_replace=True)
+        assert str(create.compile(dialect=self.engine.dialect)).startswith('CREATE OR REPLACE TABLE move_cta AS SELECT')
+        assert list(create.table.c.keys()) == ['v', 'n']
+
+        with self.engine.begin() as conn:
+            conn.execute(insert(src), [{'k': i, 'v': 'a' if i % 2 else 'b'} for i in range(6)])
+            conn.execute(create)
+            rows = conn.execute(select(create.table).order_by(create.table.c.v)).fetchall()
+        assert rows == [('a', 2), ('b', 2)], rows
+
+
+class TestReflection(TestBase):
+    @pytest.mark.parametrize("col_spec, expected", (
+        (' varchar(32) null,', ('varchar', (32,), False)),
+        (' numeric(38, 10) not null', ('numeric', (38, 10), False)),
+        (' text(1024)', ('text', (1024,), False)),
+        (' int[] null', ('int', (), True)),
+    ))
+    def test_parse_column_type(self, col_spec, expected):
+        from pysqream_sqlalchemy.dialect import parse_column_type
+        assert parse_column_type(col_spec) == expected
+
+    def test_reflect_lengths_precision_and_scale(self):
+        Logger().info('Reflection keeps lengths, precision and scale')
+        self.session.execute(DDL('create or replace table reflect_types '
+                                 '(v varchar(32) not null, n numeric(38,10), t text(1024), i int)'))
+        columns = {col['name']: col for col in self.insp.get_columns('reflect_types')}
+
+        assert isinstance(columns['v']['type'], sa.String) and columns['v']['type'].length == 32
+        assert not columns['v']['nullable']
+        assert (columns['n']['type'].precision, columns['n']['type'].scale) == (38, 10)
+        assert columns['t']['type'].length == 1024
+        assert columns['i']['nullable']
+
+    def test_buffer_sizing(self):
+        from pysqream_sqlalchemy.base import rows_per_buffer
+        from pysqream_sqlalchemy.parallel import ParallelLoader, DEFAULT_SHARD_SIZE
+
+        assert rows_per_buffer([sa.Integer()], DEFAULT_SHARD_SIZE) == DEFAULT_SHARD_SIZE
+        assert rows_per_buffer([sa.String(4000)] * 100, DEFAULT_SHARD_SIZE, buffer_bytes=4_000_100) == 10
+
+        self.session.execute(DDL('create or replace table reflect_wide (v varchar(4000), w varchar(4000))'))
+        loader = ParallelLoader(self.engine, 'reflect_wide')
+        assert loader.shard_size < DEFAULT_SHARD_SIZE
+
+    def test_storage_ddl(self):
+        Logger().info('Compression specs and CLUSTER BY are rendered and reflected')
+        metadata = sa.MetaData()
+        table = Table('reflect_storage', metadata,
+                      Column('k', sa.Integer, nullable=False, sqream_compression='dict'),
+                      Column('v', sa.UnicodeText),
+                      sqream_cluster_by=['k'])
+        ddl = str(sa.schema.CreateTable(table).compile(dialect=self.engine.dialect))
+        assert """k INTEGER NOT NULL CHECK('CS "dict"')""" in ddl
+        assert ddl.rstrip().endswith('CLUSTER BY k')
+
+        if self.insp.has_table(table.name):
+            table.drop(bind=self.engine)
+        table.create(bind=self.engine)
+
+        reflected = Table('reflect_storage', sa.MetaData(), autoload_with=self.engine)
+        assert reflected.c.k.dialect_options['sqream']['compression'] == 'dict'
+        assert reflected.c.v.dialect_options['sqream']['compression'] is None
+        assert reflected.dialect_options['sqream']['cluster_by'] == ['k']
+
+    def test_foreign_table_ddl(self):
+        Logger().info('CREATE FOREIGN TABLE renders its wrapper, location and options')
+        from pysqream_sqlalchemy.ddl import CreateForeignTable
+        table = Table('reflect_foreign', sa.MetaData(),
+                      Column('k', sa.Integer, nullable=False),
+                      Column('v', sa.UnicodeText(10)))
+        ddl = str(CreateForeignTable(table, 'csv', '/tmp/reflect_foreign.csv', options={'delimiter': '|'},
+                                     or_replace=True).compile(dialect=self.engine.dialect))
+        assert 'CREATE OR REPLACE FOREIGN TABLE reflect_foreign (' in ddl
+        assert 'WRAPPER csv_fdw' in ddl
+        assert "LOCATION = '/tmp/reflect_foreign.csv'" in ddl
+        assert "DELIMITER = '|'" in ddl
+
+
+class DDLConnection:
+    """ Answers get_ddl() with canned DDL and counts the calls """
+
+    def __init__(self, ddl):
+        self.ddl = ddl
+        self.calls = 0
+
+    def execute(self, query):
+        self.calls += 1
+        self.query = str(query)
+        self.rows = [(self.ddl,)]
+        return self
+
+    def fetchall(self):
+        return self.rows
+
+
+class TestOfflineReflection:
+    ddl = 'create table "public"."events" (\n"id" int not null,\n"name" text(20)\n)\ncluster by id\n;\n\n\n'
+
+    def test_ddl_fetched_once_per_inspector(self):
+        dialect = SqreamDialect()
+        conn = DDLConnection(self.ddl)
+        info_cache = {}
+        columns = dialect.get_columns(conn, 'events', info_cache=info_cache)
+        options = dialect.get_table_options(conn, 'events', info_cache=info_cache)
+        assert [column['name'] for column in columns] == ['id', 'name']
+        assert options == {'sqream_cluster_by': ['id']}
+        assert conn.calls == 1
+
+    def test_ddl_of_schema_qualified_table(self):
+        conn = DDLConnection(self.ddl.replace('"public"', '"staging"'))
+        columns = SqreamDialect().get_columns(conn, 'events', schema='staging', info_cache={})
+        assert conn.query == """select get_ddl('"staging"."events"')"""
+        assert columns[0]['schema'] == 'staging'
+
+    def test_foreign_table_columns(self):
+        ddl = ('create foreign table "public"."events_csv" (\n"id" int not null,\n"name" text\n)\nwrapper csv_fdw\n'
+               "options\n(\n  location = '/tmp/events.csv',\n  delimiter = '|'\n)\n;\n")
+        columns = SqreamDialect().get_columns(DDLConnection(ddl), 'events_csv', info_cache={})
+        assert [(column['name'], column['nullable']) for column in columns] == [('id', False), ('name', True)]
+        assert columns[0]['schema'] == 'public'
+
+    def test_unexpected_ddl_header(self):
+        with pytest.raises(Exception, match='unexpected get_ddl'):
+            SqreamDialect().get_columns(DDLConnection('create view "public"."v" as select 1\n'), 'v', info_cache={})
+
+    def test_unknown_column_type(self):
+        ddl = 'create table "public"."events" (\n"id" int not null,\n"shape" geography,\n"odd" ?\n)\n;\n\n\n'
+        with pytest.warns(sa.exc.SAWarning, match='Did not recognize type'):
+            columns = SqreamDialect().get_columns(DDLConnection(ddl), 'events', info_cache={})
+        assert [type(column['type']) for column in columns] == [sa.Integer, sa.types.NullType, sa.types.NullType]
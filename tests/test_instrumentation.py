@@ -0,0 +1,84 @@
+import json
+import sys
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+import sqlalchemy as sa
+from sqlalchemy import Table, Column, text, select, create_engine
+from test_base import TestBase, Logger
+from pysqream_sqlalchemy.instrumentation import PrometheusExporter, SlowQueryLog, StatementStats
+
+
+class TestPrometheusExporter:
+    def test_render(self):
+        exporter = PrometheusExporter()
+        exporter(StatementStats('select 1', execute_time=0.5, first_row_time=0.6, fetch_time=0.25, rows=1, bytes=4))
+        exporter(StatementStats('select nope', execute_time=0.5, error=Exception('nope')))
+
+        rendered = exporter.render()
+        assert 'sqream_sqlalchemy_statements_total 2' in rendered
+        assert 'sqream_sqlalchemy_statement_errors_total 1' in rendered
+        assert 'sqream_sqlalchemy_rows_total 1' in rendered
+        assert 'sqream_sqlalchemy_phase_seconds_sum{phase="execute"} 1.0' in rendered
+        assert 'sqream_sqlalchemy_phase_seconds_count{phase="first_row"} 1' in rendered
+        assert not rendered.rstrip().endswith('# EOF')
+        assert exporter.render(openmetrics=True).rstrip().endswith('# EOF')
+
+    def test_total_time(self):
+        stats = StatementStats('select 1', compile_time=1, checkout_wait=2, execute_time=3, fetch_time=4)
+        assert stats.total_time == 10
+
+
+class TestSlowQueryLogBuffer:
+    def test_threshold_and_ring_buffer(self, tmp_path):
+        path = tmp_path / 'slow.jsonl'
+        log = SlowQueryLog(capacity=2, path=str(path))
+        log.check(StatementStats('fast', execute_time=0.001), threshold_ms=100)
+        for idx in range(3):
+            log.check(StatementStats(f'slow {idx}', execute_time=0.2, parameter_rows=10), threshold_ms=100)
+
+        assert [entry['statement'] for entry in log.entries()] == ['slow 1', 'slow 2']
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [line['statement'] for line in lines] == ['slow 0', 'slow 1', 'slow 2']
+        assert lines[0]['parameters'] == {'rows': 10, 'columns': 0}
+        assert lines[0]['timings']['execute_time'] == 0.2
+
+
+class TestInstrumentation(TestBase):
+    def test_statement_stats(self):
+        Logger().info('Instrumentation tests')
+        seen = []
+        self.engine.dialect.instrumentation.add_listener(seen.append)
+        table = Table('instrumented', self.metadata, Column('i', sa.Integer), Column('t', sa.UnicodeText),
+                      extend_existing=True)
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text('create or replace table instrumented (i int, t text)'))
+                conn.execute(table.insert(), [{'i': i, 't': 'abc'} for i in range(100)])
+                res = conn.execute(select(table)).fetchall()
+        finally:
+            self.engine.dialect.instrumentation.remove_listener(seen.append)
+
+        ddl, insert, query = seen
+        assert len(res) == 100
+        assert insert.parameter_rows == 100 and insert.rows == 100
+        assert query.rows == 100
+        assert query.bytes >= 100 * 3
+        assert query.first_row_time is not None and query.first_row_time >= query.execute_time
+        assert query.statement_id is not None
+        assert all(stats.error is None for stats in seen)
+
+    def test_slow_query_log(self, tmp_path):
+        Logger().info('Slow query log tests')
+        log = SlowQueryLog(path=str(tmp_path / 'slow.jsonl'))
+        engine = create_engine(self.conn_str, slow_query_log=log)
+        with engine.connect() as conn:
+            conn.execute(text('select 1').execution_options(sqream_slow_query_ms=60_000)).fetchall()
+            conn.execute(text('select count(*) from sqream_catalog.tables')
+                         .execution_options(sqream_slow_query_ms=0)).fetchall()
+        engine.dispose()
+
+        entries = log.entries()
+        assert [entry['statement'] for entry in entries] == ['select count(*) from sqream_catalog.tables']
+        assert entries[0]['statement_id'] is not None
+        assert entries[0]['plan'] is not None or 'plan_error' in entries[0]
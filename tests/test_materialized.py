@@ -0,0 +1,54 @@
+import sys
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import Table, Column, func, insert, select
+from test_base import TestBase, Logger
+from pysqream_sqlalchemy.materialized import MaterializedAggregate
+
+
+def daily_select(table):
+    return select(table.c.day, func.count().label('n'), func.sum(table.c.v).label('total')).group_by(table.c.day)
+
+
+class TestMaterializedAggregateDefinition:
+    def test_matches_base_select_only(self):
+        table = Table('materialized_base', sa.MetaData(), Column('day', sa.Integer), Column('v', sa.Integer))
+        daily = MaterializedAggregate('materialized_daily', daily_select(table), 'day')
+        assert list(daily.table.c.keys()) == ['day', 'n', 'total']
+        assert daily.matches(daily_select(table))
+        assert not daily.matches(select(table.c.day).group_by(table.c.day))
+
+    def test_refresh_key_must_be_selected(self):
+        table = Table('materialized_base', sa.MetaData(), Column('day', sa.Integer), Column('v', sa.Integer))
+        with pytest.raises(ValueError):
+            MaterializedAggregate('materialized_daily', daily_select(table), 'v')
+
+
+class TestMaterializedAggregate(TestBase):
+    def test_incremental_refresh_and_routing(self):
+        Logger().info('Summary tables refresh the latest partitions and serve the base select')
+        table = Table('materialized_events', self.metadata, Column('day', sa.Integer), Column('v', sa.Integer))
+        for name in (table.name, 'materialized_daily'):
+            if self.insp.has_table(name):
+                self.session.execute(sa.text(f'drop table {name}'))
+        table.create(bind=self.engine)
+        daily = MaterializedAggregate('materialized_daily', daily_select(table), 'day')
+
+        with self.engine.begin() as conn:
+            conn.execute(insert(table), [{'day': day, 'v': v} for day in range(3) for v in range(4)])
+        assert daily.refresh(self.engine) is None
+
+        with self.engine.begin() as conn:
+            conn.execute(insert(table), [{'day': 2, 'v': 100}, {'day': 3, 'v': 1}])
+        assert daily.refresh(self.engine) == 2
+
+        daily.route(self.engine)
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(daily_select(table)).fetchall()
+        finally:
+            daily.unroute(self.engine)
+        assert sorted(rows) == [(0, 4, 6), (1, 4, 6), (2, 5, 106), (3, 1, 1)]
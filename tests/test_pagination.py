@@ -0,0 +1,43 @@
+import sys
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import Table, Column, insert, select
+from test_base import TestBase, Logger
+from pysqream_sqlalchemy.pagination import keyset_predicate, paginate
+
+
+class TestKeysetPredicate:
+    def test_renders_literals(self):
+        table = Table('keyset', sa.MetaData(), Column('d', sa.Integer), Column('id', sa.Integer))
+        predicate = keyset_predicate([table.c.d, table.c.id], (3, 17))
+        sql = str(select(table).where(predicate).compile(compile_kwargs={'render_postcompile': True}))
+        assert 'keyset.d > 3 OR keyset.d = 3 AND keyset.id > 17' in sql
+
+    def test_checks_key_count(self):
+        table = Table('keyset', sa.MetaData(), Column('id', sa.Integer))
+        with pytest.raises(ValueError):
+            keyset_predicate([table.c.id], (1, 2))
+
+
+class TestPaginate(TestBase):
+    def test_pages_in_key_order(self):
+        Logger().info('Keyset pagination visits every row once, in key order')
+        table = Table('paginate', self.metadata, Column('d', sa.Integer), Column('id', sa.Integer),
+                      Column('v', sa.UnicodeText))
+        if self.insp.has_table(table.name):
+            table.drop(bind=self.engine)
+        table.create(bind=self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(insert(table), [{'d': i % 4, 'id': i, 'v': f'v{i}'} for i in range(1_000)])
+
+        pages = list(paginate(self.engine, select(table), ['d', 'id'], page_size=300))
+
+        assert [len(page) for page in pages] == [300, 300, 300, 100]
+        rows = [(row.d, row.id) for page in pages for row in page]
+        assert rows == sorted((i % 4, i) for i in range(1_000))
+
+        resumed = list(paginate(self.engine, select(table.c.id), 'id', page_size=300, start_after=[899]))
+        assert [row.id for page in resumed for row in page] == list(range(900, 1_000))
@@ -0,0 +1,110 @@
+import sys
+from datetime import date
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import Table, Column, select, text
+from test_base import TestBase, Logger
+from pysqream_sqlalchemy.parallel import parallel_load, iter_shards, range_predicates, read_sql_parallel
+
+
+class TestParallelHelpers:
+    table = Table('partitioned', sa.MetaData(), Column('i', sa.Integer), Column('d', sa.Date),
+                  Column('t', sa.UnicodeText))
+
+    def test_iter_shards(self):
+        df = pd.DataFrame({'i': range(25), 't': ['a'] * 25})
+        assert [len(shard) for shard in iter_shards(df, 10)] == [10, 10, 5]
+        assert [len(shard) for shard in iter_shards(((i, 'a') for i in range(25)), 10)] == [10, 10, 5]
+
+    def test_range_predicates(self):
+        assert len(range_predicates(self.table.c.i, 0, 99, 4)) == 4
+        assert len(range_predicates(self.table.c.d, date(2024, 1, 1), date(2024, 12, 31), 4)) == 4
+
+    def test_range_of_text_column(self):
+        with pytest.raises(ValueError, match="method='modulo'"):
+            range_predicates(self.table.c.t, 'a', 'z', 4)
+        with pytest.raises(ValueError, match="method='modulo'"):
+            read_sql_parallel(select(self.table), None, 't')  # refused before asking the server for min/max
+
+
+class TestParallelLoad(TestBase):
+    table_name = 'parallel_load'
+
+    def create_table(self):
+        table = Table(self.table_name, self.metadata, Column('i', sa.Integer), Column('t', sa.UnicodeText),
+                      extend_existing=True)
+        if self.insp.has_table(table.name):
+            table.drop(bind=self.engine)
+        table.create(bind=self.engine)
+        return table
+
+    def test_parallel_load_dataframe(self):
+        Logger().info('Parallel load of a DataFrame')
+        table = self.create_table()
+        df = pd.DataFrame({'i': range(10_000), 't': [f'row {i}' for i in range(10_000)]})
+
+        report = parallel_load(self.engine, table, df, connections=4, shard_size=1_000)
+
+        assert report.rows == 10_000
+        assert len(report.shards) == 10
+        assert all(shard.rows_per_second > 0 for shard in report.shards)
+        res = self.session.execute(text(f'select count(*), sum(i) from {self.table_name}')).fetchall()
+        assert res == [(10_000, sum(range(10_000)))]
+
+    def test_parallel_load_rows_by_table_name(self):
+        Logger().info('Parallel load of a row iterator')
+        self.create_table()
+        rows = ((i, f'row {i}') for i in range(2_500))
+
+        report = parallel_load(self.engine, self.table_name, rows, connections=2, shard_size=1_000)
+
+        assert [shard.rows for shard in report.shards] == [1_000, 1_000, 500]
+        res = self.session.execute(text(f'select count(*) from {self.table_name}')).fetchall()
+        assert res == [(2_500,)]
+
+    def test_parallel_load_truncate(self):
+        Logger().info('Reloading a staging table truncates it first')
+        table = self.create_table()
+        parallel_load(self.engine, table, ((i, 'first') for i in range(1_500)), connections=2)
+
+        report = parallel_load(self.engine, table, ((i, 'second') for i in range(700)), connections=2, truncate=True)
+
+        assert report.rows == 700
+        res = self.session.execute(text(f"select count(*), min(t) from {self.table_name}")).fetchall()
+        assert res == [(700, 'second')]
+
+
+class TestParallelRead(TestBase):
+    table_name = 'parallel_read'
+
+    def create_table(self):
+        table = Table(self.table_name, self.metadata, Column('i', sa.Integer), Column('t', sa.UnicodeText),
+                      extend_existing=True)
+        if self.insp.has_table(table.name):
+            table.drop(bind=self.engine)
+        table.create(bind=self.engine)
+        parallel_load(self.engine, table, ((i, f'row {i}') for i in range(1_000)), connections=2)
+        return table
+
+    def test_read_sql_parallel_range(self):
+        Logger().info('Parallel range partitioned read')
+        table = self.create_table()
+
+        df = read_sql_parallel(sa.select(table), self.engine, 'i', partitions=4)
+
+        assert len(df.index) == 1_000
+        assert sorted(df['i']) == list(range(1_000))
+
+    def test_read_sql_parallel_modulo(self):
+        Logger().info('Parallel modulo partitioned read')
+        table = self.create_table()
+
+        df = read_sql_parallel(sa.select(table).where(text("i < 500")), self.engine, 'i', partitions=3,
+                               method='modulo')
+
+        expected = pd.read_sql(sa.select(table).where(text("i < 500")), self.engine)
+        assert sorted(df['i']) == sorted(expected['i'])
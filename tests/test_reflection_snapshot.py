@@ -0,0 +1,106 @@
+import sys
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+import sqlalchemy as sa
+from sqlalchemy import Table, Column, MetaData, create_engine, text
+from test_base import TestBase, Logger
+from pysqream_sqlalchemy.reflection_snapshot import ReflectionSnapshot
+
+
+class CatalogConnection:
+    """ Answers the fingerprint queries from a list of catalog rows """
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    def execute(self, query):
+        self.rows = self.tables if 'sqream_catalog.tables' in str(query) else []
+        return self
+
+    def fetchall(self):
+        return self.rows
+
+
+class TestSnapshotFile:
+    def test_restored_until_the_catalog_changes(self, tmp_path):
+        path = str(tmp_path / 'catalog.jsonl')
+        conn = CatalogConnection([(1, 1, 1)])
+        snapshot = ReflectionSnapshot(path, max_age=0)
+        snapshot.validate(conn, {})
+        assert snapshot.get('ddl', 'events', lambda: 'create table "public"."events" ...') == \
+            'create table "public"."events" ...'
+
+        restored = ReflectionSnapshot(path, max_age=0)
+        restored.validate(conn, {})
+        assert restored.get('ddl', 'events', lambda: 'reflected again') == 'create table "public"."events" ...'
+        assert (restored.hits, restored.misses) == (1, 0)
+
+        conn.tables = [(1, 2, 2)]  # dropped and created again
+        restored.validate(conn, {})
+        assert len(restored) == 0
+        assert restored.get('ddl', 'events', lambda: 'reflected again') == 'reflected again'
+        assert len(ReflectionSnapshot(path)) == 1
+
+    def test_validated_once_per_inspector(self, tmp_path):
+        snapshot = ReflectionSnapshot(str(tmp_path / 'catalog.jsonl'), max_age=0)
+        info_cache = {}
+        snapshot.validate(CatalogConnection([]), info_cache)
+        snapshot.validate(None, info_cache)  # no catalog queries the second time
+        assert snapshot.checks == 1
+
+    def test_fingerprint_reused_until_ddl_or_max_age(self, tmp_path):
+        snapshot = ReflectionSnapshot(str(tmp_path / 'catalog.jsonl'), max_age=60)
+        conn = CatalogConnection([])
+        for _ in range(3):  # an Inspector per Table(autoload_with=...)
+            snapshot.validate(conn, {}, schema_version=0)
+        assert snapshot.checks == 1
+        snapshot.validate(conn, {}, schema_version=1)
+        assert snapshot.checks == 2
+
+    def test_tables_keyed_by_schema(self, tmp_path):
+        path = str(tmp_path / 'catalog.jsonl')
+        snapshot = ReflectionSnapshot(path)
+        snapshot.validate(CatalogConnection([]), {})
+        snapshot.get('ddl', ('public', 'events'), lambda: 'public ddl')
+        snapshot.get('ddl', ('staging', 'events'), lambda: 'staging ddl')
+
+        restored = ReflectionSnapshot(path)
+        assert restored.get('ddl', ('staging', 'events'), lambda: 'reflected again') == 'staging ddl'
+        assert restored.get('ddl', ('public', 'events'), lambda: 'reflected again') == 'public ddl'
+
+    def test_ignores_other_formats(self, tmp_path):
+        path = tmp_path / 'catalog.jsonl'
+        path.write_text('{"format": 1, "fingerprint": "x"}\n{"kind": "ddl", "name": "t", "value": "old"}\n')
+        assert len(ReflectionSnapshot(str(path))) == 0
+        path.write_text('{"format": 2, "fingerprint"')
+        assert len(ReflectionSnapshot(str(path))) == 0
+
+
+class TestReflectionSnapshot(TestBase):
+    def test_reflect_from_snapshot(self, tmp_path):
+        Logger().info('MetaData.reflect is served from the snapshot until the catalog changes')
+        table = Table('snapshot_source', self.metadata, Column('id', sa.Integer, nullable=False),
+                      Column('name', sa.UnicodeText), Column('amount', sa.Numeric(38, 10)))
+        if self.insp.has_table(table.name):
+            table.drop(bind=self.engine)
+        table.create(bind=self.engine)
+
+        path = str(tmp_path / 'catalog.jsonl')
+        cold = MetaData()
+        cold.reflect(create_engine(self.conn_str, reflection_snapshot_path=path), only=[table.name])
+
+        engine = create_engine(self.conn_str, reflection_snapshot_path=path)
+        warm = MetaData()
+        warm.reflect(engine, only=[table.name])
+        snapshot = engine.dialect.reflection_snapshot
+        assert snapshot.misses == 0 and snapshot.hits > 0
+        assert [(c.name, repr(c.type), c.nullable) for c in warm.tables[table.name].c] == \
+            [(c.name, repr(c.type), c.nullable) for c in cold.tables[table.name].c]
+
+        with self.engine.begin() as conn:
+            conn.execute(text(f'alter table {table.name} add column extra int'))
+        changed = MetaData()
+        changed.reflect(engine, only=[table.name])
+        assert 'extra' in changed.tables[table.name].c
+        table.drop(bind=self.engine)
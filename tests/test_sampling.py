@@ -0,0 +1,54 @@
+import sys
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import Table, Column, func, insert, select
+from test_base import TestBase, Logger
+from pysqream_sqlalchemy.sampling import estimate_count, estimate_total, tablesample
+
+
+class TestEstimates:
+    def test_full_sample_is_exact(self):
+        estimate = estimate_count(1_000, 1)
+        assert (estimate.value, estimate.margin) == (1_000, 0)
+
+    def test_margin_shrinks_with_the_fraction(self):
+        small, large = estimate_count(100, 0.01), estimate_count(5_000, 0.5)
+        assert small.value == large.value == 10_000
+        assert small.margin > large.margin > 0
+        assert small.low < 10_000 < small.high
+
+    def test_total(self):
+        estimate = estimate_total(50, 500, 0.5)
+        assert estimate.value == 100
+        assert estimate.margin == pytest.approx(1.96 * (0.5 * 500) ** 0.5 / 0.5)
+
+    def test_rejects_bad_fraction(self):
+        table = Table('sampled', sa.MetaData(), Column('id', sa.Integer))
+        with pytest.raises(ValueError):
+            tablesample(table, 0, 'id')
+
+
+class TestSampling(TestBase):
+    def test_sample_estimates_count(self):
+        Logger().info('A hash sample estimates the row count within its margin')
+        table = Table('sampling', self.metadata, Column('id', sa.Integer), Column('v', sa.UnicodeText))
+        if self.insp.has_table(table.name):
+            table.drop(bind=self.engine)
+        table.create(bind=self.engine)
+
+        with self.engine.begin() as conn:
+            conn.execute(insert(table), [{'id': i, 'v': f'v{i}'} for i in range(20_000)])
+            sample = tablesample(table, 0.1, 'id')
+            count = conn.execute(select(func.count()).select_from(sample)).scalar()
+            again = conn.execute(select(func.count()).select_from(sample)).scalar()
+            distinct, median = conn.execute(select(func.approx_count_distinct(table.c.v),
+                                                   func.approx_percentile(table.c.id, 0.5))).one()
+
+        assert count == again
+        estimate = estimate_count(count, 0.1)
+        assert estimate.low < 20_000 < estimate.high
+        assert distinct == 20_000
+        assert 9_900 < median < 10_100
@@ -0,0 +1,116 @@
+import re
+import sys
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import Table, Column, bindparam, insert, select
+from test_base import TestBase, Logger
+from pysqream_sqlalchemy.dialect import SqreamDialect
+from pysqream_sqlalchemy.saved_queries import (SavedQueries, drop_saved_query_sql, execute_saved_query_sql, render_value,
+                                               saved_query_name)
+
+
+class TestSavedQueryLRU:
+    def test_evicts_least_recently_used(self):
+        saved = SavedQueries(capacity=2)
+        name_a, save_a, _ = saved.acquire('a', 'select 1')
+        saved.acquire('b', 'select 2')
+        assert saved.acquire('a', 'select 1') == (name_a, False, [])
+
+        name_c, save_c, evicted = saved.acquire('c', 'select 3')
+
+        assert save_a and save_c
+        assert evicted == [saved_query_name('select 2')]
+        assert 'a' in saved and 'b' not in saved and len(saved) == 2
+
+    def test_rejects_empty_capacity(self):
+        with pytest.raises(ValueError):
+            SavedQueries(capacity=0)
+
+    def test_execute_renders_literals(self):
+        sql = execute_saved_query_sql('q', [1, None, "it's", True])
+        assert sql == "select execute_saved_query('q', 1, NULL, 'it''s', true)"
+
+    @pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf'), Decimal('NaN'), Decimal('Infinity')])
+    def test_rejects_values_without_literal(self, value):
+        with pytest.raises(ValueError):
+            render_value(value)
+
+
+class SavedQueryCursor:
+    """ Keeps the saved queries like the server does, drop_saved_query() can be called behind the dialect's back """
+
+    def __init__(self):
+        self.saved = set()
+        self.executed = []
+
+    def execute(self, sql):
+        name = re.search(r"\('(\w+)'", sql).group(1)
+        self.executed.append(sql.split('(')[0])
+        if sql.startswith('select save_query'):
+            self.saved.add(name)
+        elif sql.startswith('select execute_saved_query') and name not in self.saved:
+            raise Exception(f'saved query {name} not found')
+
+
+class TestSavedQueryExecution:
+    def test_saved_again_when_dropped_elsewhere(self):
+        dialect = SqreamDialect()
+        cursor = SavedQueryCursor()
+        context = SimpleNamespace(compiled=None)
+        dialect._execute_saved(cursor, 'select * from t where id = ?', [1], context)
+        cursor.saved.clear()  # another process evicted the shared name
+
+        dialect._execute_saved(cursor, 'select * from t where id = ?', [2], context)
+
+        assert cursor.executed == ['select save_query', 'select execute_saved_query', 'select execute_saved_query',
+                                   'select save_query', 'select execute_saved_query']
+        assert len(dialect.saved_queries) == 1
+
+    def test_rejected_value_is_not_remembered_as_saved(self):
+        dialect = SqreamDialect()
+        with pytest.raises(ValueError):
+            dialect._execute_saved(SavedQueryCursor(), 'select * from t where x = ?', [float('nan')],
+                                   SimpleNamespace(compiled=None))
+        assert len(dialect.saved_queries) == 0
+
+    def test_rejected_value_keeps_saved_queries(self):
+        dialect = SqreamDialect(saved_query_capacity=1)
+        cursor = SavedQueryCursor()
+        context = SimpleNamespace(compiled=None)
+        dialect._execute_saved(cursor, 'select * from t where x = ?', [1], context)
+        for statement in ('select * from t where x = ?', 'select * from t where y = ?'):
+            with pytest.raises(ValueError):
+                dialect._execute_saved(cursor, statement, [float('inf')], context)
+
+        assert 'select * from t where x = ?' in dialect.saved_queries  # still saved on the server
+        assert cursor.executed == ['select save_query', 'select execute_saved_query']  # nothing evicted
+
+
+class TestSavedQueries(TestBase):
+    def test_saved_lookup(self):
+        Logger().info('Parameterized lookups run as a saved query')
+        table = Table('saved_lookup', self.metadata, Column('id', sa.Integer), Column('name', sa.UnicodeText))
+        if self.insp.has_table(table.name):
+            table.drop(bind=self.engine)
+        table.create(bind=self.engine)
+
+        lookup = select(table.c.name).where(table.c.id == bindparam('id')).execution_options(sqream_saved_query=True)
+        with self.engine.connect() as conn:
+            conn.execute(insert(table), [{'id': i, 'name': f'name {i}'} for i in range(10)])
+            names = [conn.execute(lookup, {'id': i}).scalar() for i in (3, 7)]
+            assert len(self.engine.dialect.saved_queries) == 1
+
+            Logger().info('A saved query dropped by another process is saved again')
+            name = next(iter(self.engine.dialect.saved_queries._names.values()))
+            with self.engine.connect() as other:
+                other.exec_driver_sql(drop_saved_query_sql(name))
+            names.append(conn.execute(lookup, {'id': 5}).scalar())
+            self.engine.dialect.drop_saved_queries(conn)
+
+        assert names == ['name 3', 'name 7', 'name 5']
+        assert len(self.engine.dialect.saved_queries) == 0
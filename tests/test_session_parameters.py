@@ -0,0 +1,53 @@
+import sys
+
+sys.path.insert(0, 'pysqream_sqlalchemy')
+sys.path.insert(0, 'tests')
+from sqlalchemy import text, create_engine
+from test_base import TestBase, Logger
+from pysqream_sqlalchemy.base import SESSION_KEY, PooledSession, render_session_parameter
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(statement)
+
+
+class TestPooledSession:
+    def test_render(self):
+        assert render_session_parameter('spoolMemoryGB', 8) == 'SET spoolMemoryGB = 8'
+        assert render_session_parameter('developerMode', True) == 'SET developerMode = true'
+        assert render_session_parameter('timezone', "it's") == "SET timezone = 'it''s'"
+
+    def test_only_changes_are_applied(self):
+        cursor = RecordingCursor()
+        session = PooledSession(cursor)
+        session.apply({'a': 1, 'b': 'x'})
+        session.apply({'a': 1, 'b': 'x'})
+        session.apply({'a': 2, 'b': 'x'})
+
+        assert cursor.statements == ['SET a = 1', "SET b = 'x'", 'SET a = 2']
+
+
+class TestSessionParameters(TestBase):
+
+    def test_applied_once_per_connection(self):
+        Logger().info('Session parameters are set once on the pooled connection')
+        engine = create_engine(self.conn_str, pool_size=1, max_overflow=0,
+                               session_parameters={'statementLockTimeout': 30})
+        try:
+            for _ in range(3):
+                with engine.connect() as conn:
+                    assert conn.execute(text('select 1')).fetchall() == [(1,)]
+                    session = conn.connection.info[SESSION_KEY]
+                    assert session.applied == {'statementLockTimeout': 30}
+
+            engine.dialect.session_parameters['statementLockTimeout'] = 60
+            with engine.connect() as conn:
+                assert conn.execute(text('select 1')).fetchall() == [(1,)]
+                assert conn.connection.info[SESSION_KEY] is session
+                assert session.applied == {'statementLockTimeout': 60}
+        finally:
+            engine.dispose()